@@ -0,0 +1,149 @@
+# -*- encoding: utf-8 -*-
+"""Benchmarks the oap providers and export on synthetic statements.
+
+    python bench/bench_oap.py --sizes 1000,10000,100000
+    python bench/bench_oap.py --update-baseline     # record the current numbers
+    python bench/bench_oap.py --check               # exit 1 on a regression or a case without baseline
+
+bench/baselines.json is the committed baseline for the default sizes of every
+kind. grc_pdf stops at 10000 rows by default: rendering and parsing a 100000 row
+PDF takes far longer than the other cases together.
+
+The resolve stage is the time the provider spent classifying accounts while
+parsing, taken from its "resolve" timer, and is included in the parse stage.
+
+Every case runs in a fresh process so its peak RSS is not polluted by the
+cases before it.
+"""
+import os, sys, json, time, argparse, contextlib, multiprocessing
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+import synth
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baselines.json")
+DEFAULT_WORK_DIR = os.path.join(BENCH_DIR, ".work")
+PROVIDERS = {
+    "wechat_xlsx": ("oap.statements.cn_wechat", "ChinaWechatProvider"),
+    "wechat_csv": ("oap.statements.cn_wechat", "ChinaWechatProvider"),
+    "grc_pdf": ("oap.statements.cn_bnk_grc", "ChinaBankGRCProvider"),
+}
+# Row counts benchmarked when --sizes is not given
+DEFAULT_SIZES = {
+    "wechat_xlsx": "1000,10000,100000",
+    "wechat_csv": "1000,10000,100000",
+    "grc_pdf": "1000,10000",
+}
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+@contextlib.contextmanager
+def quiet():
+    # Keep anything printed by the providers or pdfplumber out of the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def run_case(kind, path, result_queue):
+    import importlib
+    from oap.export_mgr import ExportManager
+    from oap.metrics import METRICS
+    module_name, class_name = PROVIDERS[kind]
+    provider_cls = getattr(importlib.import_module(module_name), class_name)
+    if kind.startswith("wechat"):
+        params = {"payer_accounts": synth.wechat_payer_accounts()}
+    else:
+        params = {"payee_accounts": synth.grc_payee_accounts()}
+    results = []
+
+    with quiet():
+        provider = provider_cls(kind, class_name, params)
+        METRICS.reset()
+        start = time.perf_counter()
+        statement = provider.start(path)
+        results.append(("parse", time.perf_counter() - start, len(statement.transactions), peak_rss_mb()))
+        # Measured row by row inside the parse, a second pass would only hit the warm memo
+        resolve_seconds, resolve_calls = METRICS.timers.get("resolve", (0.0, 0))
+        results.append(("resolve", resolve_seconds, resolve_calls, peak_rss_mb()))
+
+        export_mgr = ExportManager(workers=1)
+        export_mgr.config = {}
+        export_mgr.statement_list_by_key[kind] = []
+        export_mgr._add_statement(statement)
+        start = time.perf_counter()
+        export_mgr.export_all(os.devnull)
+        results.append(("export", time.perf_counter() - start, len(statement.transactions), peak_rss_mb()))
+    result_queue.put(results)
+
+def run_isolated(kind, path):
+    ctx = multiprocessing.get_context("spawn")
+    result_queue = ctx.Queue()
+    proc = ctx.Process(target=run_case, args=(kind, path, result_queue))
+    proc.start()
+    results = result_queue.get()
+    proc.join()
+    return results
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", help="comma separated row counts, up to 1000000, for every kind (default: per kind, "
+                        + "; ".join(f"{kind} {sizes}" for kind, sizes in DEFAULT_SIZES.items()) + ")")
+    parser.add_argument("--kinds", default=",".join(PROVIDERS), help="comma separated subset of " + ",".join(PROVIDERS))
+    parser.add_argument("--work-dir", default=DEFAULT_WORK_DIR, help="where generated statements are kept")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--check", action="store_true", help="fail when rows/sec drops below the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed rows/sec drop before --check fails")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    current = {}
+    regressions = []
+    missing = []
+    print(f"{'case':<28}{'stage':<10}{'rows':>9}{'wall s':>10}{'rows/s':>12}{'peak MB':>10}{'baseline':>12}")
+    for kind in args.kinds.split(","):
+        for rows in (int(size) for size in (args.sizes or DEFAULT_SIZES[kind]).split(",")):
+            path = synth.ensure_file(kind, rows, args.work_dir)
+            case = f"{kind}/{rows}"
+            for stage, wall, n_rows, peak in run_isolated(kind, path):
+                rate = n_rows / wall if wall > 0 else float("inf")
+                key = f"{case}/{stage}"
+                current[key] = rate
+                base_rate = baseline.get(key)
+                print(f"{case:<28}{stage:<10}{n_rows:>9}{wall:>10.3f}{rate:>12.0f}{(peak or 0):>10.1f}{(base_rate or 0):>12.0f}")
+                if base_rate is None:
+                    missing.append(key)
+                elif rate < base_rate * (1 - args.tolerance):
+                    regressions.append(f"{key}: {rate:.0f} rows/s vs baseline {base_rate:.0f}")
+
+    if args.update_baseline:
+        baseline.update(current)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        missing = []
+    if regressions:
+        print("PERFORMANCE REGRESSION:")
+        for line in regressions:
+            print("  " + line)
+    if missing:
+        print(f"NO BASELINE in {args.baseline}, run with --update-baseline first:")
+        for key in missing:
+            print("  " + key)
+    if args.check and (regressions or missing):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# -*- encoding: utf-8 -*-
+"""Synthetic WeChat bills and GRC statements for benchmarking the oap providers"""
+import os, sys, csv, random, datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from oap.statements.cn_bnk_grc import ChinaBankGRCProvider, GRCTransaction
+from oap.statements.cn_wechat import ChinaWechatProvider
+
+WECHAT_HEADER = ["交易时间", "交易类型", "交易对方", "商品", "收/支", "金额(元)", "支付方式", "当前状态", "交易单号", "商户单号", "备注"]
+WECHAT_NICKNAME = "bench"
+WECHAT_CARD = "招商银行信用卡(0000)"
+COUNTERPARTIES = ["美团", "滴滴出行", "京东", "拼多多", "星巴克", "中国石化", "财付通", "李四"]
+
+def wechat_payer_accounts():
+    return {
+        f"微信支付({WECHAT_NICKNAME})": "Assets:Current:Cash:Wechat",
+        WECHAT_CARD: "Liabilities:CreditCard:CM",
+    }
+
+def grc_payee_accounts():
+    # Keyword, prefix and regex rules over the synthetic counterparties, some limited by amount
+    return [
+        {"account": "Expenses:Food", "counterparty": {"keyword": ["美团", "星巴克"]}, "amount": [-500, 0]},
+        {"account": "Expenses:Transport", "counterparty": {"prefix": ["滴滴"]}},
+        {"account": "Expenses:Shopping", "counterparty": {"keyword": ["京东", "拼多多"]}},
+        {"account": "Expenses:Car", "counterparty": {"regex": ["^中国石[化油]$"]}},
+        {"account": "Expenses:Food:Large", "counterparty": {"keyword": ["美团", "星巴克"]}},
+        {"account": "Equity:Transfer", "postscript": {"prefix": ["附言1"]}},
+    ]
+
+def wechat_rows(rows, seed=1):
+    yield [ChinaWechatProvider.TITLE]
+    yield [f"微信昵称：[{WECHAT_NICKNAME}]"]
+    yield ["起始时间：[2020-01-01 00:00:00] 终止时间：[2029-12-31 23:59:59]"]
+    yield ["导出类型：[全部]"]
+    yield ["导出时间：[2030-01-01 00:00:00]"]
+    yield [None]
+    yield [f"共{rows}笔记录"]
+    yield ["----------------------微信支付账单明细列表--------------------"]
+    yield WECHAT_HEADER
+    rnd = random.Random(seed)
+    txn_dt = datetime.datetime(2020, 1, 1)
+    for idx in range(rows):
+        txn_dt += datetime.timedelta(seconds=rnd.randint(1, 600))
+        income = rnd.random() < 0.2
+        yield [
+            txn_dt.strftime("%Y-%m-%d %H:%M:%S"), "商户消费", rnd.choice(COUNTERPARTIES), "商品",
+            "收入" if income else "支出", f"¥{rnd.uniform(0.01, 5000):,.2f}",
+            "零钱" if income or rnd.random() < 0.5 else WECHAT_CARD,
+            "支付成功", f"T{idx:012d}", f"M{idx:012d}", "/",
+        ]
+
+def write_wechat_xlsx(path, rows, seed=1):
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Sheet1")
+    for row_cells in wechat_rows(rows, seed):
+        sheet.append(row_cells)
+    workbook.save(path)
+
+def write_wechat_csv(path, rows, seed=1):
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        for row_cells in wechat_rows(rows, seed):
+            writer.writerow(["" if cell is None else cell for cell in row_cells])
+
+def grc_rows(rows, seed=1):
+    rnd = random.Random(seed)
+    balance = 100000.0
+    day = datetime.date(2020, 1, 1)
+    for seq in range(1, rows + 1):
+        if rnd.random() < 0.3:
+            day += datetime.timedelta(days=1)
+        amount = round(rnd.uniform(-2000, 2000), 2)
+        balance += amount
+        yield [str(seq), day.strftime("%Y%m%d"), f"{amount:,.2f}", f"{balance:,.2f}",
+               f"6222{rnd.randint(0, 10 ** 12 - 1):012d}", rnd.choice(COUNTERPARTIES), "银行", "消费", f"附言{seq}"]
+
+def write_grc_pdf(path, rows, seed=1):
+    # reportlab is only needed for the benchmarks, not by oap itself
+    try:
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib.styles import ParagraphStyle
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    except ImportError:
+        raise RuntimeError("reportlab is required to generate GRC statements: pip install reportlab")
+    pdfmetrics.registerFont(UnicodeCIDFont("STSong-Light"))
+    style = ParagraphStyle("grc", fontName="STSong-Light", fontSize=9)
+    head = [
+        ChinaBankGRCProvider.TITLE,
+        f"{ChinaBankGRCProvider.SEC_TITLE} BENCH0001",
+        "账户名称: 基准 查询起止日期: 20200101-20291231",
+        "账户账号: 6222000000000000 账单申请时间: 2030-01-01 00:00:00",
+    ]
+    table = Table([list(GRCTransaction.HEADER)] + list(grc_rows(rows, seed)))
+    table.setStyle(TableStyle([
+        ("FONT", (0, 0), (-1, -1), "STSong-Light", 7),
+        ("GRID", (0, 0), (-1, -1), 0.5, "black"),
+    ]))
+    doc = SimpleDocTemplate(path, pagesize=A4)
+    doc.build([Paragraph(line, style) for line in head] + [Spacer(1, 6), table])
+
+WRITERS = {
+    "wechat_xlsx": (write_wechat_xlsx, ".xlsx"),
+    "wechat_csv": (write_wechat_csv, ".csv"),
+    "grc_pdf": (write_grc_pdf, ".pdf"),
+}
+
+def ensure_file(kind, rows, work_dir):
+    """Generate (once) and return the path of a synthetic statement"""
+    writer, suffix = WRITERS[kind]
+    os.makedirs(work_dir, exist_ok=True)
+    path = os.path.join(work_dir, f"{kind}_{rows}{suffix}")
+    if not os.path.exists(path):
+        writer(path + ".part" + suffix, rows)
+        os.replace(path + ".part" + suffix, path)
+    return path
@@ -1,11 +1,28 @@
 import asyncio
-from daily_note import DailyNote
+from concurrent.futures import ProcessPoolExecutor
+from daily_note import parse_daily_note, day_from_title
 from joplin import JoplinClipperServerEndpoint, JoplinDataAPI
+from joplin_mirror import JoplinMirror
+from joplin_db import JoplinDatabaseAPI
+from timelog_store import TimelogStore
+from daily_note_cache import DailyNoteCache
+
+# Notes fetched but not yet handed to the parser, the fetch waits when it is full
+PIPELINE_QUEUE_SIZE = 256
+# Notes handed to the parser pool and not parsed yet
+PIPELINE_MAX_IN_FLIGHT = 64
 
 class Application:
-    def __init__(self) -> None:
-        clipper_ep = JoplinClipperServerEndpoint(self)
-        self._joplin_api = JoplinDataAPI(clipper_ep)
+    def __init__(self, mirror_path=None, base_url=None, database_path=None, parse_cache_path=None) -> None:
+        self.timelog_store = TimelogStore()
+        self._parse_cache = DailyNoteCache(parse_cache_path) if parse_cache_path else None
+        if database_path:
+            # Offline, straight from the database file of the desktop app
+            self._joplin_api = JoplinDatabaseAPI(database_path)
+            return
+        clipper_ep = JoplinClipperServerEndpoint(self, base_url=base_url)
+        mirror = JoplinMirror(mirror_path) if mirror_path else None
+        self._joplin_api = JoplinDataAPI(clipper_ep, mirror=mirror)
 
     def run(self) -> None:
         asyncio.run(self.async_run())
@@ -14,13 +31,73 @@ class Application:
         try:
             await self._joplin_api.initialize()
             self._joplin_api.dump()
-            notes = await self._joplin_api.get_folder_notes_with_path("MyLog/Daily")
-            for one_note in notes:
-                daily_note = DailyNote()
-                daily_note.set_content(one_note.body)
-                
+            await self.update_timelog_streamed("MyLog/Daily")
         finally:
             await self.do_cleanup()
 
+    async def update_timelog_streamed(self, path, workers=None):
+        """Add the notes under path to the timelog store, parsing them in a process
+        pool while the rest are still being fetched.
+
+        Only notes edited since they were last added are looked at again, and only
+        those missing from the parse cache go through markdown."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        in_flight = asyncio.Semaphore(PIPELINE_MAX_IN_FLIGHT)
+
+        async def produce():
+            try:
+                async for one_note in self._joplin_api.iter_folder_notes_with_path(path):
+                    await queue.put(one_note)
+            finally:
+                await queue.put(None)
+
+        stale_notes, bodies, daily_notes, missed = [], [], [], []
+        # Started on the first note that has to be parsed, a run where every note is
+        # current or cached never pays for the worker processes
+        executor = None
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                one_note = await queue.get()
+                if one_note is None:
+                    break
+                if self.timelog_store.is_current(one_note.id, one_note.updated_time):
+                    continue
+                body = one_note.body
+                day = day_from_title(one_note.title)
+                daily_note = None
+                if self._parse_cache is not None:
+                    daily_note = self._parse_cache.lookup([(one_note.id, body, day)])[0]
+                if daily_note is None:
+                    if executor is None:
+                        executor = ProcessPoolExecutor(max_workers=workers)
+                    await in_flight.acquire()
+                    daily_note = loop.run_in_executor(executor, parse_daily_note, body, True, day)
+                    daily_note.add_done_callback(lambda _: in_flight.release())
+                    missed.append(len(daily_notes))
+                stale_notes.append(one_note)
+                bodies.append(body)
+                daily_notes.append(daily_note)
+            await producer
+            # Results are put back in the order the notes arrived
+            parsed = await asyncio.gather(*[daily_notes[idx] for idx in missed])
+        finally:
+            if not producer.done():
+                producer.cancel()
+            if executor is not None:
+                executor.shutdown()
+        for idx, daily_note in zip(missed, parsed):
+            daily_notes[idx] = daily_note
+        self._add_daily_notes(stale_notes, bodies, daily_notes, missed)
+
+    def _add_daily_notes(self, stale_notes, bodies, daily_notes, missed):
+        if self._parse_cache is not None and missed:
+            self._parse_cache.store([(stale_notes[idx].id, bodies[idx], daily_notes[idx]) for idx in missed])
+        for one_note, daily_note in zip(stale_notes, daily_notes):
+            self.timelog_store.update(one_note.id, one_note.updated_time, daily_note)
+
     async def do_cleanup(self) -> None:
-        await self._joplin_api.close()
\ No newline at end of file
+        await self._joplin_api.close()
+        if self._parse_cache is not None:
+            self._parse_cache.close()
\ No newline at end of file
@@ -1,54 +1,313 @@
-import yaml, re
-from datetime import timedelta, datetime
+import os, yaml, re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta, datetime, date
 from markdown_it import MarkdownIt
 from markdown_it.tree import SyntaxTreeNode
 
+TIMELOG_SECTION = "Timelog"
+# Below this many notes a process pool costs more than it saves
+PARALLEL_MIN_NOTES = 64
+
+# "09:00-10:30", "9:00~10:30" or "0900-1030"
+_TIME_SPAN_RE = re.compile(r"^(\d{1,2}):?(\d{2})\s*[-~]\s*(\d{1,2}):?(\d{2})$")
+_TAG_RE = re.compile(r"#(\S+)")
+_FENCE_RE = re.compile(r"^(`{3,}|~{3,})\s*(.*?)\s*$")
+# Indent, marker, spaces after it and the rest of a bullet item line
+_LIST_ITEM_RE = re.compile(r"^( *)([-*+])( +|$)(.*)$")
+_ORDERED_ITEM_RE = re.compile(r"^ *\d{1,9}[.)]( |$)")
+_THEMATIC_BREAK_RE = re.compile(r"^ *([-*_])( *\1){2,} *$")
+# May start a block other than a paragraph
+_BLOCK_START_CHARS = set("#>`~<=-*+_|[")
+
+# libyaml when available, the pure Python loader is most of the parse time
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+_md_parser = None
+def get_md_parser():
+    """The commonmark parser shared by every note of this process"""
+    global _md_parser
+    if _md_parser is None:
+        _md_parser = MarkdownIt("commonmark")
+    return _md_parser
+
 class TimelogEntry(object):
+    __slots__ = ("start_dt", "end_dt", "delta_time", "tags", "description")
+
     def __init__(self) -> None:
         self.start_dt = None
+        self.end_dt = None
         self.delta_time = None
+        self.tags = list()
+        self.description = None
+
+    @classmethod
+    def parse(cls, content, day):
+        """Entry of content ("09:00-10:30 what #tag") on day, None if it has no time span"""
+        time_span_str, _, sub_content = content.partition(" ")
+        span_match = _TIME_SPAN_RE.match(time_span_str)
+        if span_match is None:
+            return None
+        start_h, start_m, end_h, end_m = (int(part) for part in span_match.groups())
+        entry = cls()
+        day_start = datetime.combine(day, datetime.min.time())
+        entry.start_dt = day_start + timedelta(hours=start_h, minutes=start_m)
+        entry.end_dt = day_start + timedelta(hours=end_h, minutes=end_m)
+        if entry.end_dt < entry.start_dt:
+            # Went past midnight
+            entry.end_dt += timedelta(days=1)
+        entry.delta_time = entry.end_dt - entry.start_dt
+        entry.tags = _TAG_RE.findall(sub_content)
+        entry.description = sub_content
+        return entry
+
+    def __repr__(self):
+        return f"TimelogEntry(start_dt={self.start_dt}, end_dt={self.end_dt}, delta_time={self.delta_time}, tags={self.tags})"
 
 class DailyNote(object):
-    def __init__(self) -> None:
+    def __init__(self, day=None) -> None:
         self.front_matter_obj = None
+        # The date in the front matter wins over the one given here (e.g. from the note title)
+        self.day = day
         self.timelog = list()
+        # Timelog entries as written, before they are split up
+        self.timelog_contents = list()
+
+    def _read_day(self):
+        if not isinstance(self.front_matter_obj, dict):
+            return
+        day = self.front_matter_obj.get("date")
+        if isinstance(day, datetime):
+            self.day = day.date()
+        elif isinstance(day, date):
+            self.day = day
+        elif isinstance(day, str):
+            try:
+                self.day = date.fromisoformat(day.strip())
+            except ValueError:
+                pass
 
     def read_front_matter(self, root_node):
         front_matter_node = root_node.children[0]
         if front_matter_node.info == "yaml":
-            self.front_matter_obj = yaml.safe_load(front_matter_node.content)
+            self.front_matter_obj = yaml.load(front_matter_node.content, Loader=_YamlLoader)
+            self._read_day()
 
     def read_all_section(self, root_node):
         sub_section_nodes = root_node[1]
         assert(sub_section_nodes.type == "bullet_list")
         for section in sub_section_nodes.children:
             section_title = section.children[0].children[0].content
-            if section_title == "Timelog":
+            if section_title == TIMELOG_SECTION and len(section.children) > 1:
                 self.read_timelog(section.children[1])
-            print(section_title)
-        
+
     def read_timelog(self, timelog_node):
         for timelog_entry_node in timelog_node.children:
             if len(timelog_entry_node.children) <= 0:
-                # Dummy entry 
+                # Dummy entry
                 continue
             content = timelog_entry_node.children[0].children[0].content
             self.add_timelog(content)
 
     def add_timelog(self, content):
-        time_span_str, sub_content = content.split(" ", maxsplit=1)
-        tags = re.findall(r"#\S+", sub_content)
-        
-        print(time_span_str, "|", sub_content, )
+        self.timelog_contents.append(content)
+        if self.day is None:
+            return
+        entry = TimelogEntry.parse(content, self.day)
+        if entry is not None:
+            self.timelog.append(entry)
 
     def set_content(self, content):
-        md_obj = MarkdownIt("commonmark")
-        tokens = md_obj.parse(content)
+        tokens = get_md_parser().parse(content)
         node = SyntaxTreeNode(tokens)
         self.read_front_matter(node)
         self.read_all_section(node)
-        
+
         # print(node.children[0].info)
         # print(node.children[1], node.children[1].children[0].children[1].children[1].children[0].children[0].content)
         # yaml_obj = yaml.safe_load(node.children[0].content)
-        # print(yaml_obj)
\ No newline at end of file
+        # print(yaml_obj)
+
+    def set_content_fast(self, content):
+        """Same result as set_content, read line by line without building the markdown tree.
+
+        Only the plain daily note layout is read this way: a ```yaml front matter,
+        then one bullet list of sections. Anything the scan does not model exactly
+        (tabs, ordered lists, hard breaks, code, lazy lines...) goes to set_content."""
+        try:
+            yaml_text, timelog_contents = _scan_daily_note(content)
+        except _NotPlainLayout:
+            self.set_content(content)
+            return
+        self.front_matter_obj = yaml.load(yaml_text, Loader=_YamlLoader)
+        self._read_day()
+        for timelog_content in timelog_contents:
+            self.add_timelog(timelog_content)
+
+class _NotPlainLayout(Exception):
+    pass
+
+def _entry_content(entry_lines, entry_col):
+    # A hard break keeps the trailing spaces in the tree, leave that to it
+    for line in entry_lines[:-1]:
+        if line != line.rstrip(" "):
+            raise _NotPlainLayout()
+    first_line = entry_lines[0].strip(" ")
+    if first_line[:1] in _BLOCK_START_CHARS:
+        raise _NotPlainLayout()
+    return "\n".join([first_line] + [line[entry_col:].strip(" ") for line in entry_lines[1:]])
+
+def _scan_daily_note(content):
+    """(front matter yaml, timelog entry contents) of a note in the plain layout"""
+    lines = content.splitlines()
+    line_no = 0
+    while line_no < len(lines) and not lines[line_no].strip(" "):
+        line_no += 1
+    fence_match = _FENCE_RE.match(lines[line_no]) if line_no < len(lines) else None
+    if fence_match is None or fence_match.group(2) != "yaml":
+        raise _NotPlainLayout()
+    fence = fence_match.group(1)
+    body_lines = []
+    line_no += 1
+    while True:
+        if line_no >= len(lines):
+            raise _NotPlainLayout()
+        line = lines[line_no]
+        line_no += 1
+        closing = line.strip(" ")
+        if len(closing) >= len(fence) and closing == fence[0] * len(closing):
+            if line[:1] == " ":
+                raise _NotPlainLayout()
+            break
+        body_lines.append(line)
+    yaml_text = "".join(line + "\n" for line in body_lines)
+
+    while line_no < len(lines) and not lines[line_no].strip(" "):
+        line_no += 1
+    first_item = _LIST_ITEM_RE.match(lines[line_no]) if line_no < len(lines) else None
+    if first_item is None or first_item.group(1):
+        raise _NotPlainLayout()
+    section_marker = first_item.group(2)
+
+    timelog_contents = []
+    in_timelog = False
+    section_col = None
+    entry_indent = None
+    entry_marker = None
+    entry_col = None
+    entry_lines = None
+    entry_is_dummy = False
+    prev_blank = False
+
+    def flush():
+        if entry_lines is not None:
+            timelog_contents.append(_entry_content(entry_lines, entry_col))
+
+    for line in lines[line_no:]:
+        if "\t" in line or line.strip() != line.strip(" "):
+            raise _NotPlainLayout()
+        if not line.strip(" "):
+            flush()
+            entry_lines = None
+            prev_blank = True
+            continue
+        if _THEMATIC_BREAK_RE.match(line) or _ORDERED_ITEM_RE.match(line) or line.lstrip(" ")[:3] in ("```", "~~~"):
+            raise _NotPlainLayout()
+        indent = len(line) - len(line.lstrip(" "))
+        item_match = _LIST_ITEM_RE.match(line)
+        if item_match is not None and len(item_match.group(3)) > 4 and item_match.group(4).strip(" "):
+            # Indented code inside the item
+            raise _NotPlainLayout()
+
+        if indent == 0:
+            if item_match is None:
+                if prev_blank:
+                    # A paragraph after the list, the sections are over
+                    break
+                raise _NotPlainLayout()
+            if item_match.group(2) != section_marker:
+                raise _NotPlainLayout()
+            flush()
+            entry_lines = None
+            # Every Timelog section counts, like in the tree
+            in_timelog = item_match.group(4).strip(" ") == TIMELOG_SECTION
+            section_col = 1 + max(len(item_match.group(3)), 1)
+            entry_indent = None
+            prev_blank = False
+            continue
+        if indent < section_col:
+            raise _NotPlainLayout()
+        if not in_timelog:
+            prev_blank = False
+            continue
+
+        if entry_indent is None:
+            # The first line below the Timelog title opens the entry list
+            if item_match is None or indent >= section_col + 4:
+                raise _NotPlainLayout()
+            entry_indent = indent
+            entry_marker = item_match.group(2)
+        if item_match is not None and indent == entry_indent:
+            if item_match.group(2) != entry_marker:
+                raise _NotPlainLayout()
+            flush()
+            text = item_match.group(4)
+            # An empty item is a dummy entry
+            entry_is_dummy = not text.strip(" ")
+            entry_lines = None if entry_is_dummy else [text]
+            entry_col = indent + 1 + max(len(item_match.group(3)), 1)
+        elif entry_is_dummy or indent <= entry_indent or entry_col is None or indent < entry_col:
+            raise _NotPlainLayout()
+        elif item_match is not None:
+            if indent >= entry_col + 4:
+                # Too deep for a list, it continues the paragraph
+                raise _NotPlainLayout()
+            # Nested under the entry, its first paragraph is over
+            flush()
+            entry_lines = None
+        elif entry_lines is not None:
+            if prev_blank or indent != entry_col or line.lstrip(" ")[:1] in _BLOCK_START_CHARS:
+                raise _NotPlainLayout()
+            entry_lines.append(line)
+        # Else a later paragraph or nested content of the entry, which the tree ignores too
+        prev_blank = False
+    flush()
+    return yaml_text, timelog_contents
+
+def day_from_title(title):
+    """Day of a note titled like "2024-01-31 ...", None for other titles"""
+    try:
+        return date.fromisoformat((title or "")[:10])
+    except ValueError:
+        return None
+
+def parse_daily_note(content, fast=True, day=None):
+    daily_note = DailyNote(day)
+    if fast:
+        daily_note.set_content_fast(content)
+    else:
+        daily_note.set_content(content)
+    return daily_note
+
+def parse_daily_notes(contents, fast=True, workers=None, chunksize=32, days=None):
+    """Parse many note bodies, in order, across a process pool when there are enough of them.
+
+    days optionally gives the day of each note for notes without a date in their front matter."""
+    contents = list(contents)
+    days = [None] * len(contents) if days is None else list(days)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(contents) < PARALLEL_MIN_NOTES:
+        return [parse_daily_note(content, fast, day) for content, day in zip(contents, days)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(parse_daily_note, contents, [fast] * len(contents), days, chunksize=chunksize))
+
+def check_fast_path(content):
+    """Differences between set_content_fast and set_content on content, empty when they agree"""
+    tree_note = parse_daily_note(content, fast=False)
+    fast_note = parse_daily_note(content, fast=True)
+    differences = []
+    if tree_note.front_matter_obj != fast_note.front_matter_obj:
+        differences.append(("front_matter", tree_note.front_matter_obj, fast_note.front_matter_obj))
+    if tree_note.timelog_contents != fast_note.timelog_contents:
+        differences.append(("timelog", tree_note.timelog_contents, fast_note.timelog_contents))
+    return differences
@@ -0,0 +1,87 @@
+import os, time, zlib, pickle, sqlite3
+from daily_note import DailyNote
+from joplin import body_hash
+
+# Bump when the stored state or the way notes are parsed changes, older entries are then dropped
+CACHE_SCHEMA = 2
+DEFAULT_MAX_ENTRIES = 20000
+
+def dump_daily_note(daily_note):
+    # Timelog entries are rebuilt from their text, which keeps entries small and
+    # lets TimelogEntry change without touching the cache. The day is left out:
+    # without a date in the front matter it comes from the note title, which the
+    # body hash does not cover.
+    state = (daily_note.front_matter_obj, daily_note.timelog_contents)
+    return zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+
+def load_daily_note(data, day=None):
+    front_matter_obj, timelog_contents = pickle.loads(zlib.decompress(data))
+    daily_note = DailyNote(day)
+    daily_note.front_matter_obj = front_matter_obj
+    daily_note._read_day()
+    for content in timelog_contents:
+        daily_note.add_timelog(content)
+    return daily_note
+
+class DailyNoteCache(object):
+    """Parsed daily notes in SQLite, keyed by note id and the hash of the body they came from.
+
+    Least recently used entries are dropped once there are more than max_entries.
+    """
+    def __init__(self, db_path, max_entries=DEFAULT_MAX_ENTRIES) -> None:
+        self.db_path = db_path
+        self.max_entries = max_entries
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path)
+        self._create_tables()
+
+    def _create_tables(self):
+        conn = self._conn
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = conn.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+        if row is not None and int(row[0]) != CACHE_SCHEMA:
+            conn.execute("DROP TABLE IF EXISTS entries")
+        conn.execute("CREATE TABLE IF NOT EXISTS entries (note_id TEXT PRIMARY KEY, body_hash BLOB, data BLOB, used_time REAL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_used_time ON entries (used_time)")
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema', ?)", (str(CACHE_SCHEMA),))
+        conn.commit()
+
+    def lookup(self, notes):
+        """DailyNote for every (note_id, body, day) in notes, None where the cache has nothing current.
+
+        day is used like in parse_daily_note, for notes without a date in their front matter."""
+        results = []
+        hit_ids = []
+        for note_id, body, day in notes:
+            row = self._conn.execute("SELECT body_hash, data FROM entries WHERE note_id = ?", (note_id,)).fetchone()
+            if row is None or row[0] != body_hash(body):
+                results.append(None)
+                continue
+            results.append(load_daily_note(row[1], day))
+            hit_ids.append(note_id)
+        if hit_ids:
+            now = time.time()
+            with self._conn:
+                self._conn.executemany("UPDATE entries SET used_time = ? WHERE note_id = ?", [(now, note_id) for note_id in hit_ids])
+        return results
+
+    def store(self, notes):
+        """Remember the DailyNote of every (note_id, body, daily_note) in notes"""
+        now = time.time()
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO entries (note_id, body_hash, data, used_time) VALUES (?, ?, ?, ?)", [
+                (note_id, body_hash(body), dump_daily_note(daily_note), now) for note_id, body, daily_note in notes
+            ])
+        self.evict()
+
+    def evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        with self._conn:
+            self._conn.execute("DELETE FROM entries WHERE note_id IN (SELECT note_id FROM entries ORDER BY used_time LIMIT ?)", (count - self.max_entries,))
+
+    def close(self):
+        self._conn.close()
@@ -1,11 +1,46 @@
-import aiohttp, asyncio
+import os, sys, json, hashlib, aiohttp, asyncio
+from collections import OrderedDict
 from http import HTTPStatus
 from urllib.parse import urlsplit, urljoin
 
 FOLDER_SEP = "/"
 GLOBAL_MAX_PAGES = 100
+# Items per page, the clipper server allows at most 100
+PAGE_LIMIT = 100
+# Connection pool of the clipper server client
+MAX_CONNECTIONS = 8
+KEEPALIVE_TIMEOUT = 30
+# Folders listed at the same time
+FETCH_CONCURRENCY = 8
+# Notes written at the same time
+WRITE_CONCURRENCY = 4
+NOTE_FIELDS = ["id", "parent_id", "title", "body", "updated_time"]
+# Listing every note without bodies, they are fetched per folder when read
+NOTE_LIST_FIELDS = ["id", "parent_id", "title", "updated_time"]
+FOLDER_FIELDS = ["id", "parent_id", "title", "updated_time"]
+# /events items
+EVENT_ITEM_TYPE_NOTE = 1
+EVENT_TYPE_DELETE = 3
+# Ping timeout per probed port, the server is local so it answers fast or not at all
+PROBE_TIMEOUT = 0.5
+# Where the discovered url and the accepted token are kept between runs
+DEFAULT_CREDENTIALS_PATH = os.path.join("~", ".config", "shane_app", "joplin_clipper.json")
+# Memory kept for note bodies, older bodies are reloaded or refetched when needed
+BODY_CACHE_BYTES = 64 * 1024 * 1024
+
+def body_hash(body):
+    return hashlib.sha1(body.encode("utf-8")).digest()
+
+class JoplinRequestError(Exception):
+    """A page of a listing could not be fetched, the listing is incomplete"""
+    def __init__(self, uri, status) -> None:
+        super().__init__("%s returned %s" % (uri, status))
+        self.uri = uri
+        self.status = status
 
 class ResourceObject(object):
+    __slots__ = ("id", "title")
+
     def __init__(self) -> None:
         self.id = ""
         self.title = None
@@ -14,21 +49,88 @@ class ResourceObject(object):
         self.id = data_dict["id"]
         self.title = data_dict["title"]
 
+class NoteBodyCache(object):
+    """Note bodies by note id, least recently used dropped first once over max_bytes.
+
+    A miss asks loader(note_id) when there is one, otherwise the body is gone
+    until the note is fetched again.
+    """
+    def __init__(self, max_bytes=BODY_CACHE_BYTES, loader=None) -> None:
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self._bodies = OrderedDict()
+        self._size = 0
+
+    def get(self, note_id):
+        body = self._bodies.get(note_id)
+        if body is not None:
+            self._bodies.move_to_end(note_id)
+            return body
+        if self.loader is None:
+            return None
+        body = self.loader(note_id)
+        if body is not None:
+            self.put(note_id, body)
+        return body
+
+    def put(self, note_id, body):
+        self.discard(note_id)
+        self._bodies[note_id] = body
+        self._size += sys.getsizeof(body)
+        while self._size > self.max_bytes and len(self._bodies) > 1:
+            _, dropped_body = self._bodies.popitem(last=False)
+            self._size -= sys.getsizeof(dropped_body)
+
+    def discard(self, note_id):
+        body = self._bodies.pop(note_id, None)
+        if body is not None:
+            self._size -= sys.getsizeof(body)
+
+    @property
+    def size(self):
+        return self._size
+
 class Note(ResourceObject):
-    def __init__(self) -> None:
+    __slots__ = ("parent_id", "updated_time", "body_hash", "_body", "_body_cache")
+
+    def __init__(self, body_cache=None) -> None:
         super().__init__()
         self.parent_id = None
-        self.body = None
+        self.updated_time = None
+        # Hash of the last body seen, it outlives the body when the cache drops that
+        self.body_hash = None
+        # Without a cache the body is simply kept on the note
+        self._body_cache = body_cache
+        self._body = None
+
+    @property
+    def body(self):
+        if self._body_cache is None:
+            return self._body
+        return self._body_cache.get(self.id)
+
+    @body.setter
+    def body(self, body):
+        if body is not None:
+            self.body_hash = body_hash(body)
+        if self._body_cache is None:
+            self._body = body
+        elif body is not None:
+            self._body_cache.put(self.id, body)
 
     def fill_data(self, data_dict):
         super().fill_data(data_dict)
         self.parent_id = data_dict["parent_id"]
         self.body = data_dict.get("body", None)
+        self.updated_time = data_dict.get("updated_time", None)
 
 class Folder(ResourceObject):
+    __slots__ = ("parent", "parent_id", "sub_folders", "sub_folders_by_name", "notes")
+
     def __init__(self) -> None:
         super().__init__()
         self.parent = None
+        self.parent_id = None
         self.sub_folders = list()
         self.sub_folders_by_name = dict()
         self.notes = list()
@@ -48,11 +150,20 @@ class Folder(ResourceObject):
     def add_note(self, note):
         self.notes.append(note)
 
+    def iter_notes(self):
+        """Notes of this folder and of all folders below it"""
+        yield from self.notes
+        for sub_folder in self.sub_folders:
+            yield from sub_folder.iter_notes()
+
 class FolderHierarchy(object):
     def __init__(self) -> None:
         self._root = Folder()
         self._root.title = "*ROOT*"
         self._folder_by_guid = dict()
+        # Full path -> folder, rebuilt on the first lookup after the tree changed
+        self._folder_by_path = None
+        self._notes_by_title = dict()
 
     def get_folder(self, id, create_stub=True):
         if id == "":
@@ -72,7 +183,25 @@ class FolderHierarchy(object):
         new_folder.fill_data(folder_data)
         parent_folder = self.get_folder(new_folder.parent_id)
         parent_folder.add_child(new_folder)
+        self._folder_by_path = None
         return new_folder
+
+    def add_note(self, note):
+        self.get_folder(note.parent_id).add_note(note)
+        self._notes_by_title.setdefault(note.title, []).append(note)
+
+    def refill_note(self, note, note_data):
+        """Fill a note already added with newer data, moving it in the title index when it was renamed"""
+        old_title = note.title
+        note.fill_data(note_data)
+        if note.title == old_title:
+            return
+        same_title_notes = self._notes_by_title.get(old_title, [])
+        if note in same_title_notes:
+            same_title_notes.remove(note)
+            if not same_title_notes:
+                del self._notes_by_title[old_title]
+        self._notes_by_title.setdefault(note.title, []).append(note)
     
     def dump_folder(self, folder, indent=1):
         print("\t" * (indent - 1), "[%s]" % folder.title)
@@ -84,29 +213,41 @@ class FolderHierarchy(object):
     def dump(self):
         self.dump_folder(self._root)
 
+    def _index_paths(self, folder, path, folder_by_path):
+        for sub_folder in folder.sub_folders:
+            sub_path = sub_folder.title if folder is self._root else path + FOLDER_SEP + sub_folder.title
+            folder_by_path[sub_path] = sub_folder
+            self._index_paths(sub_folder, sub_path, folder_by_path)
+
     def get_folder_with_path(self, folder_path):
-        split_path = folder_path.split(FOLDER_SEP)
-        current_folder = self._root
-        found = True
-        for folder_entry in split_path:
-            current_folder = current_folder.sub_folders_by_name.get(folder_entry)
-            if current_folder is None:
-                found = False
-                break
-        if found:
-            return current_folder
-        else:
-            return None
+        if self._folder_by_path is None:
+            folder_by_path = dict()
+            self._index_paths(self._root, "", folder_by_path)
+            self._folder_by_path = folder_by_path
+        return self._folder_by_path.get(folder_path.rstrip(FOLDER_SEP))
+
+    def get_notes_with_title(self, title):
+        return self._notes_by_title.get(title, [])
+
+    def iter_notes_under(self, folder_path):
+        """All notes in the folder at folder_path ("MyLog/" or "MyLog") and its sub folders"""
+        folder = self.get_folder_with_path(folder_path)
+        if folder is None:
+            return iter(())
+        return folder.iter_notes()
 
         
 class JoplinClipperServerEndpoint(object):
-    def __init__(self, aio_http_client) -> None:
-        self._base_url = "http://localhost"
+    def __init__(self, aio_http_client, max_connections=MAX_CONNECTIONS, base_url=None, credentials_path=DEFAULT_CREDENTIALS_PATH) -> None:
+        # A given base_url (e.g. a fake server in tests) is used as is, without probing ports
+        self._probe = base_url is None
+        self._base_url = base_url or "http://localhost"
         self._port = None
-        # TODO Test token
         self._auth_token = None
+        self._credentials_path = os.path.expanduser(credentials_path) if credentials_path else None
         self._port_probe_range = range(41184, 41194)
         self._client = aio_http_client
+        self._max_connections = max_connections
         self._sys_url = {
             "auth": "auth",
             "auth_check": "auth/check",
@@ -114,12 +255,56 @@ class JoplinClipperServerEndpoint(object):
         }
 
     async def initialize(self):
-        self._client = aiohttp.ClientSession()
-        await self.probe_url()
+        # The server is local and single host, keep a few connections alive and reuse them
+        connector = aiohttp.TCPConnector(limit=self._max_connections, limit_per_host=self._max_connections, keepalive_timeout=KEEPALIVE_TIMEOUT)
+        self._client = aiohttp.ClientSession(connector=connector)
+        # Last run's url and token cost a single request when they still work
+        self.load_credentials()
+        if self._auth_token is not None and await self.validate_token():
+            return True
+        if self._probe and not await self.probe_url():
+            return False
+        if self._auth_token is not None and not await self.validate_token():
+            self._auth_token = None
         await self.check_auth()
         if self._auth_token is None:
             return False
+        self.save_credentials()
         return True
+
+    def load_credentials(self):
+        if self._credentials_path is None or not os.path.exists(self._credentials_path):
+            return
+        try:
+            with open(self._credentials_path, encoding="utf-8") as f:
+                credentials = json.load(f)
+        except (OSError, ValueError) as e:
+            print("Ignore broken credentials file:", e)
+            return
+        if self._probe:
+            self._base_url = credentials.get("base_url") or self._base_url
+        elif credentials.get("base_url") != self._base_url:
+            # Saved for another server
+            return
+        self._auth_token = credentials.get("token")
+
+    def save_credentials(self):
+        if self._credentials_path is None:
+            return
+        os.makedirs(os.path.dirname(self._credentials_path), exist_ok=True)
+        tmp_path = self._credentials_path + ".tmp"
+        # The token grants full access to the notes, keep it private
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"base_url": self._base_url, "token": self._auth_token}, f)
+        os.replace(tmp_path, self._credentials_path)
+
+    async def validate_token(self):
+        status, _ = await self.api_request("GET", "/folders", query_params={
+            "limit": 1,
+            "fields": "id",
+        }, timeout=PROBE_TIMEOUT * 4)
+        return status == 200
     
     async def get_note(self, id, fields=None):
         query_params = dict()
@@ -128,15 +313,77 @@ class JoplinClipperServerEndpoint(object):
 
         return await self.api_request("GET", "/notes/%s" % id, query_params=query_params)
     
+    async def create_note(self, note_data):
+        return await self.api_request("POST", "/notes", json_data=note_data)
+
+    async def update_note(self, id, note_data):
+        return await self.api_request("PUT", "/notes/%s" % id, json_data=note_data)
+
+    async def create_folder(self, title, parent_id=""):
+        return await self.api_request("POST", "/folders", json_data={
+            "title": title,
+            "parent_id": parent_id,
+        })
+
     async def get_folders(self, page=1):
         return await self.api_request("GET", "/folders", query_params={
             "page": page
         })
     
-    async def get_folders_notes(self, folder_id, page=1):
-        return await self.api_request("GET", "/folders/%s/notes" % folder_id, query_params={
+    async def get_folders_notes(self, folder_id, page=1, fields=None):
+        query_params = {
             "page": page
-        })
+        }
+        if fields is not None:
+            query_params["fields"] = ",".join(fields)
+        return await self.api_request("GET", "/folders/%s/notes" % folder_id, query_params=query_params)
+
+    async def iter_pages(self, uri, fields=None, limit=PAGE_LIMIT, order_by=None, order_dir=None, max_pages=GLOBAL_MAX_PAGES):
+        """Yield the items of every page of a list endpoint as the pages arrive.
+
+        Stop iterating to stop paging, no further page is requested. Raises
+        JoplinRequestError when a page fails, rather than ending the listing early."""
+        page = 1
+        while True:
+            if page > max_pages:
+                print("Max pages exceed, consider change GLOBAL_MAX_PAGES")
+                return
+            query_params = {
+                "page": page
+            }
+            if fields is not None:
+                query_params["fields"] = ",".join(fields)
+            if limit is not None:
+                query_params["limit"] = limit
+            if order_by is not None:
+                query_params["order_by"] = order_by
+            if order_dir is not None:
+                query_params["order_dir"] = order_dir
+            status, ret_obj = await self.api_request("GET", uri, query_params=query_params)
+            if status != 200:
+                raise JoplinRequestError(uri, status)
+            yield ret_obj["items"]
+            if not ret_obj["has_more"]:
+                return
+            page += 1
+
+    async def iter_items(self, uri, **kwargs):
+        async for items in self.iter_pages(uri, **kwargs):
+            for item in items:
+                yield item
+
+    def iter_folders(self, **kwargs):
+        return self.iter_items("/folders", **kwargs)
+
+    def iter_folder_notes(self, folder_id, **kwargs):
+        return self.iter_items("/folders/%s/notes" % folder_id, **kwargs)
+
+    async def get_events(self, cursor=None):
+        """Note changes after cursor, or only the latest cursor when there is none"""
+        query_params = dict()
+        if cursor is not None:
+            query_params["cursor"] = cursor
+        return await self.api_request("GET", "/events", query_params=query_params)
 
     def get_sys_url(self, method):
         return urljoin(self._base_url, self._sys_url[method])
@@ -188,25 +435,38 @@ class JoplinClipperServerEndpoint(object):
             else:
                 raise RuntimeError("Unknow query status:" + str(status))
             
+    async def ping(self, url):
+        try:
+            async with self._client.get(urljoin(url, "ping"), timeout=aiohttp.ClientTimeout(total=PROBE_TIMEOUT)) as resp:
+                content = await resp.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+        return content == "JoplinClipperServer"
+
     async def probe_url(self):
+        """Ping every candidate port at once, the first to answer wins (the lowest port on a tie)"""
         base_url_parse = urlsplit(self._base_url)
         hostname = base_url_parse.hostname
-        for i in self._port_probe_range:
-            # Change port to probe
-            base_url_parse = base_url_parse._replace(netloc=(hostname + ":%s" % i))
-            new_port_url = base_url_parse.geturl()
-            ping_url = urljoin(new_port_url, "ping")
-            print(ping_url)
-            try:
-                resp = await self._client.get(ping_url)
-                content = await resp.text()
-                if (content == "JoplinClipperServer"):
-                    self._base_url = new_port_url
-                    break
-            except:
-                print("Probe failed, try next port")
-
+        candidate_urls = [base_url_parse._replace(netloc=(hostname + ":%s" % i)).geturl() for i in self._port_probe_range]
+        url_by_task = {asyncio.ensure_future(self.ping(url)): url for url in candidate_urls}
+        pending = set(url_by_task)
+        found_url = None
+        try:
+            while pending and found_url is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=lambda task: candidate_urls.index(url_by_task[task])):
+                    if task.result():
+                        found_url = url_by_task[task]
+                        break
+        finally:
+            for task in pending:
+                task.cancel()
+        if found_url is None:
+            print("No clipper server found on ports %s-%s" % (self._port_probe_range[0], self._port_probe_range[-1]))
+            return False
+        self._base_url = found_url
         print("probeURL:", self._base_url)
+        return True
         
     async def close(self):
         session_to_destroy = self._client
@@ -215,45 +475,136 @@ class JoplinClipperServerEndpoint(object):
         await asyncio.sleep(0.25)
 
 class JoplinDataAPI(object):
-    def __init__(self, endpoint) -> None:
+    def __init__(self, endpoint, fetch_concurrency=FETCH_CONCURRENCY, mirror=None, body_cache_bytes=BODY_CACHE_BYTES) -> None:
         self.resources = dict()
         self.folders = FolderHierarchy()
         self.notes = dict()
         self._endpoint = endpoint
+        self._fetch_concurrency = fetch_concurrency
+        # Optional JoplinMirror, when set reads are served from it after an incremental sync
+        self._mirror = mirror
+        # Bodies in the mirror are loaded on demand, fetched ones are kept until evicted
+        self.body_cache = NoteBodyCache(body_cache_bytes, mirror.get_note_body if mirror is not None else None)
 
     async def initialize(self):
         if await self._endpoint.initialize() is False:
             return False
         
-        await self.fetch_folders()
-        await self.fetch_folders_notes()
+        if self._mirror is None:
+            try:
+                await self.fetch_folders()
+                await self.fetch_folders_notes(fields=NOTE_LIST_FIELDS)
+            except JoplinRequestError as e:
+                print("Listing notes failed:", e)
+                return False
+        else:
+            await self.sync_mirror()
+            self.load_mirror()
 
     async def close(self):
         await self._endpoint.close()
+        if self._mirror is not None:
+            self._mirror.close()
 
-    async def fetch_folders(self):
-        page = 1
-        all_folders = list()
-        while True:
-            if page > GLOBAL_MAX_PAGES:
-                print("Max pages exceed, consider change GLOBAL_MAX_PAGES")
-                break
+    async def sync_mirror(self):
+        """Bring the mirror up to date. When a listing fails the mirror keeps what it
+        had, it is served as is and the next sync tries again."""
+        try:
+            folder_data_list = [folder_data async for folder_data in self._endpoint.iter_folders(fields=FOLDER_FIELDS)]
+        except JoplinRequestError as e:
+            print("Listing folders failed, mirror not synced:", e)
+            return
+        if self._mirror.cursor is None or not await self._sync_mirror_events():
+            if not await self._sync_mirror_full(folder_data_list):
+                return
+        self._mirror.replace_folders(folder_data_list)
 
-            status, ret_obj = await self._endpoint.get_folders(page)
+    async def _sync_mirror_full(self, folder_data_list):
+        print("Full sync of the local mirror")
+        # Take the cursor first, changes made while crawling are replayed next time
+        status, ret_obj = await self._endpoint.get_events()
+        if status != 200:
+            return False
+        cursor = ret_obj["cursor"]
+        semaphore = asyncio.Semaphore(self._fetch_concurrency)
+        listed_ids = set()
+
+        async def fetch_one(folder_id):
+            async with semaphore:
+                async for items in self._endpoint.iter_pages("/folders/%s/notes" % folder_id, fields=NOTE_FIELDS):
+                    # Listed notes are current, writing them before the crawl is complete does no harm
+                    self._mirror.upsert_notes(items)
+                    listed_ids.update(item["id"] for item in items)
+
+        results = await asyncio.gather(*[fetch_one(folder_data["id"]) for folder_data in folder_data_list], return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        for error in errors:
+            if not isinstance(error, JoplinRequestError):
+                raise error
+        if errors:
+            # Notes missing from an incomplete crawl must not be dropped, nor skipped by the cursor
+            print("Full sync incomplete, mirror cursor not advanced:", errors[0])
+            return False
+        self._mirror.delete_notes([note_data["id"] for note_data in self._mirror.iter_notes(with_body=False) if note_data["id"] not in listed_ids])
+        self._mirror.set_cursor(cursor)
+        return True
+
+    async def _sync_mirror_events(self):
+        cursor = self._mirror.cursor
+        # Only the last event of a note matters
+        event_type_by_note = dict()
+        while True:
+            status, ret_obj = await self._endpoint.get_events(cursor)
             if status != 200:
+                print("Events not available, fall back to full sync")
+                return False
+            for event in ret_obj["items"]:
+                if event["item_type"] == EVENT_ITEM_TYPE_NOTE:
+                    event_type_by_note[event["item_id"]] = event["type"]
+            cursor = ret_obj["cursor"]
+            if not ret_obj["has_more"]:
                 break
-            items = ret_obj["items"]
-            all_folders.extend(items)
-            has_more = ret_obj["has_more"]
-            if not has_more:
-                break
-            page += 1
-        for new_folder_data in all_folders:
+
+        deleted_ids = [note_id for note_id, event_type in event_type_by_note.items() if event_type == EVENT_TYPE_DELETE]
+        failed_ids = []
+        semaphore = asyncio.Semaphore(self._fetch_concurrency)
+
+        async def fetch_one(note_id):
+            async with semaphore:
+                status, note_data = await self._endpoint.get_note(note_id, NOTE_FIELDS)
+            if status == 200:
+                self._mirror.upsert_notes([note_data])
+            elif status == HTTPStatus.NOT_FOUND:
+                deleted_ids.append(note_id)
+            else:
+                failed_ids.append(note_id)
+
+        await asyncio.gather(*[fetch_one(note_id) for note_id, event_type in event_type_by_note.items() if event_type != EVENT_TYPE_DELETE])
+        self._mirror.delete_notes(deleted_ids)
+        if failed_ids:
+            # Keep the old cursor, the next sync replays these events instead of losing the notes
+            print("Fetching %d changed notes failed, mirror cursor not advanced" % len(failed_ids))
+            return True
+        self._mirror.set_cursor(cursor)
+        print("Mirror synced, %d notes changed" % len(event_type_by_note))
+        return True
+
+    def load_mirror(self):
+        for folder_data in self._mirror.iter_folders():
+            res_folder = self.folders.add_folder_data(folder_data)
+            self.add_resource(res_folder)
+        for note_data in self._mirror.iter_notes(with_body=False):
+            new_note = self.create_note(note_data)
+            self.folders.add_note(new_note)
+
+    async def fetch_folders(self):
+        # Parents listed after their children are stubbed until they arrive
+        async for new_folder_data in self._endpoint.iter_folders():
             res_folder = self.folders.add_folder_data(new_folder_data)
             self.add_resource(res_folder)
 
     def create_note(self, note_data):
-        new_note = Note()
+        new_note = Note(self.body_cache)
         new_note.fill_data(note_data)
         self.resources[new_note.id] = new_note
         self.notes[new_note.id] = new_note
@@ -262,46 +613,140 @@ class JoplinDataAPI(object):
     def add_resource(self, res):
         self.resources[res.id] = res
 
-    async def fetch_folders_notes(self, current_foler=None):
-        if current_foler is None:
-            current_foler = self.folders._root
-        if current_foler.id is not None:
-            note_data_list = await self._get_folder_notes(current_foler.id)
-            for one_note_data in note_data_list:
-                new_note = self.create_note(one_note_data)
-                current_foler.add_note(new_note)
-
-        for sub_folder in current_foler.sub_folders:
-            await self.fetch_folders_notes(sub_folder)
-        
-    async def _get_folder_notes(self, folder_id):
-        page = 1
-        all_notes = list()
-        while True:
-            if page > GLOBAL_MAX_PAGES:
-                print("Max pages exceed, consider change GLOBAL_MAX_PAGES")
-                break
-            status, ret_obj = await self._endpoint.get_folders_notes(folder_id)
-            if status != 200:
-                break
-            items = ret_obj["items"]
-            all_notes.extend(items)
-            has_more = ret_obj["has_more"]
-            if not has_more:
-                break
-            page += 1
-        return all_notes
-    
+    def iter_folders(self, current_folder=None):
+        if current_folder is None:
+            current_folder = self.folders._root
+        for sub_folder in current_folder.sub_folders:
+            yield sub_folder
+            yield from self.iter_folders(sub_folder)
+
+    async def fetch_folders_notes(self, current_foler=None, fields=NOTE_FIELDS):
+        """List the notes of every folder under current_foler, a few folders at a time.
+
+        Bodies only come with the listing when fields has "body", so no request per note is needed."""
+        semaphore = asyncio.Semaphore(self._fetch_concurrency)
+
+        async def fetch_one(folder):
+            async with semaphore:
+                async for one_note_data in self._endpoint.iter_folder_notes(folder.id, fields=fields):
+                    new_note = self.create_note(one_note_data)
+                    self.folders.add_note(new_note)
+
+        await asyncio.gather(*[fetch_one(folder) for folder in self.iter_folders(current_foler)])
+
     async def get_folder_notes_with_path(self, path):
         folder = self.folders.get_folder_with_path(path)
         if folder is None:
             return None
-        for one_note in folder.notes:
-            status, note_data = await self._endpoint.get_note(one_note.id, ["id", "parent_id", "title", "body"])
-            # TODO Check status
-            one_note.fill_data(note_data)
+        if self._mirror is None and any(one_note.body is None for one_note in folder.notes):
+            # Notes were listed without bodies or their bodies were evicted, list the
+            # folder again with them instead of asking for every note on its own
+            note_by_id = {one_note.id: one_note for one_note in folder.notes}
+            async for note_data in self._endpoint.iter_folder_notes(folder.id, fields=NOTE_FIELDS):
+                one_note = note_by_id.get(note_data["id"])
+                if one_note is not None:
+                    self.folders.refill_note(one_note, note_data)
 
         return folder.notes
     
+    async def iter_folder_notes_with_path(self, path):
+        """Yield the notes of the folder at path with their bodies, as they arrive"""
+        folder = self.folders.get_folder_with_path(path)
+        if folder is None:
+            return
+        if self._mirror is not None or all(one_note.body is not None for one_note in folder.notes):
+            for one_note in folder.notes:
+                yield one_note
+            return
+        note_by_id = {one_note.id: one_note for one_note in folder.notes}
+        async for note_data in self._endpoint.iter_folder_notes(folder.id, fields=NOTE_FIELDS):
+            one_note = note_by_id.get(note_data["id"])
+            if one_note is None:
+                one_note = self.create_note(note_data)
+                self.folders.add_note(one_note)
+            else:
+                self.folders.refill_note(one_note, note_data)
+            yield one_note
+
+    async def ensure_folder_with_path(self, path):
+        """Folder at path, creating the missing folders along it. None when one cannot be created."""
+        folder = self.folders.get_folder_with_path(path)
+        if folder is not None:
+            return folder
+        parent_folder = self.folders.get_folder("")
+        walked_path = list()
+        for title in path.strip(FOLDER_SEP).split(FOLDER_SEP):
+            walked_path.append(title)
+            folder = self.folders.get_folder_with_path(FOLDER_SEP.join(walked_path))
+            if folder is None:
+                status, folder_data = await self._endpoint.create_folder(title, parent_folder.id)
+                if status != 200:
+                    print("Create folder %s failed: %s" % (FOLDER_SEP.join(walked_path), status))
+                    return None
+                folder = self.folders.add_folder_data({"id": folder_data["id"], "parent_id": parent_folder.id, "title": title})
+                self.add_resource(folder)
+            parent_folder = folder
+        return folder
+
+    def find_note(self, folder, title):
+        for one_note in self.folders.get_notes_with_title(title):
+            if one_note.parent_id == folder.id:
+                return one_note
+        return None
+
+    async def upsert_notes(self, notes, concurrency=WRITE_CONCURRENCY):
+        """Write (folder path, title, body) notes back to Joplin.
+
+        Missing folders and notes are created, notes found by title in their folder
+        are updated, and notes whose body hash is unchanged cost no request at all.
+        Returns the number of notes created, updated, unchanged and failed."""
+        notes = list(notes)
+        counts = dict.fromkeys(("created", "updated", "unchanged", "failed"), 0)
+        # Folders first and one at a time, so concurrent notes never create the same folder twice
+        folder_by_path = dict()
+        for folder_path, _, _ in notes:
+            if folder_path not in folder_by_path:
+                folder_by_path[folder_path] = await self.ensure_folder_with_path(folder_path)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def upsert_one(folder, title, body):
+            if folder is None:
+                counts["failed"] += 1
+                return
+            one_note = self.find_note(folder, title)
+            if one_note is None:
+                async with semaphore:
+                    status, note_data = await self._endpoint.create_note({"parent_id": folder.id, "title": title, "body": body})
+                if status != 200:
+                    counts["failed"] += 1
+                    return
+                new_note = self.create_note({"id": note_data["id"], "parent_id": folder.id, "title": title, "body": body, "updated_time": note_data.get("updated_time")})
+                self.folders.add_note(new_note)
+                counts["created"] += 1
+                return
+            if one_note.body_hash is None:
+                # Listed without its body and never fetched since, the mirror may still have it
+                known_body = one_note.body
+                if known_body is None:
+                    async with semaphore:
+                        status, note_data = await self._endpoint.get_note(one_note.id, ["body"])
+                    if status == 200:
+                        known_body = note_data.get("body")
+                one_note.body = known_body
+            if one_note.body_hash == body_hash(body):
+                counts["unchanged"] += 1
+                return
+            async with semaphore:
+                status, note_data = await self._endpoint.update_note(one_note.id, {"body": body})
+            if status != 200:
+                counts["failed"] += 1
+                return
+            one_note.body = body
+            one_note.updated_time = note_data.get("updated_time", one_note.updated_time)
+            counts["updated"] += 1
+
+        await asyncio.gather(*[upsert_one(folder_by_path[folder_path], title, body) for folder_path, title, body in notes])
+        return counts
+
     def dump(self):
         self.folders.dump()
\ No newline at end of file
@@ -0,0 +1,66 @@
+import os, sqlite3, pathlib
+from joplin import JoplinDataAPI
+
+DEFAULT_DATABASE_PATH = os.path.join("~", ".config", "joplin-desktop", "database.sqlite")
+
+class JoplinDatabase(object):
+    """Read-only view of the database.sqlite of a Joplin profile.
+
+    Offers the same reads as JoplinMirror, so JoplinDataAPI.load_mirror can
+    build the hierarchy from it without the desktop app running.
+    """
+    def __init__(self, db_path=DEFAULT_DATABASE_PATH) -> None:
+        self.db_path = os.path.expanduser(db_path)
+        # mode=ro never writes, the desktop app may have the file open meanwhile.
+        # as_uri() quotes "?", "#" and "%" in the path, which would end it early otherwise.
+        self._conn = sqlite3.connect(pathlib.Path(self.db_path).resolve().as_uri() + "?mode=ro", uri=True)
+        self._note_filter = self._build_note_filter()
+
+    def _build_note_filter(self):
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(notes)")}
+        conditions = []
+        # Conflict copies and notes in the trash are not part of the notebook
+        if "is_conflict" in columns:
+            conditions.append("is_conflict = 0")
+        if "deleted_time" in columns:
+            conditions.append("deleted_time = 0")
+        return conditions
+
+    def iter_folders(self):
+        sql = "SELECT id, parent_id, title, updated_time FROM folders"
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(folders)")}
+        if "deleted_time" in columns:
+            sql += " WHERE deleted_time = 0"
+        for id, parent_id, title, updated_time in self._conn.execute(sql):
+            yield {"id": id, "parent_id": parent_id, "title": title, "updated_time": updated_time}
+
+    def iter_notes(self, parent_id=None, with_body=True):
+        sql = "SELECT id, parent_id, title, %s, updated_time FROM notes" % ("body" if with_body else "NULL")
+        conditions = list(self._note_filter)
+        args = ()
+        if parent_id is not None:
+            conditions.append("parent_id = ?")
+            args = (parent_id,)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        for id, parent_id, title, body, updated_time in self._conn.execute(sql, args):
+            yield {"id": id, "parent_id": parent_id, "title": title, "body": body, "updated_time": updated_time}
+
+    def get_note_body(self, note_id):
+        row = self._conn.execute("SELECT body FROM notes WHERE id = ?", (note_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def close(self):
+        self._conn.close()
+
+class JoplinDatabaseAPI(JoplinDataAPI):
+    """JoplinDataAPI reading Joplin's database file directly instead of the clipper server"""
+    def __init__(self, db_path=DEFAULT_DATABASE_PATH) -> None:
+        super().__init__(None, mirror=JoplinDatabase(db_path))
+
+    async def initialize(self):
+        self.load_mirror()
+        return True
+
+    async def close(self):
+        self._mirror.close()
@@ -0,0 +1,81 @@
+import os, sqlite3
+
+# Bump when the tables change, an old mirror is then dropped and synced again
+MIRROR_SCHEMA = 1
+
+class JoplinMirror(object):
+    """Local SQLite copy of the Joplin folders and notes.
+
+    The events cursor of the last sync is kept with the data, so the next
+    sync only has to fetch the notes changed since then.
+    """
+    def __init__(self, db_path) -> None:
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path)
+        self._create_tables()
+
+    def _create_tables(self):
+        conn = self._conn
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = conn.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+        if row is not None and int(row[0]) != MIRROR_SCHEMA:
+            conn.executescript("DROP TABLE IF EXISTS folders; DROP TABLE IF EXISTS notes; DELETE FROM meta;")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS folders (
+                id TEXT PRIMARY KEY, parent_id TEXT, title TEXT, updated_time INTEGER);
+            CREATE TABLE IF NOT EXISTS notes (
+                id TEXT PRIMARY KEY, parent_id TEXT, title TEXT, body TEXT, updated_time INTEGER);
+            CREATE INDEX IF NOT EXISTS notes_parent_id ON notes (parent_id);
+        """)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema', ?)", (str(MIRROR_SCHEMA),))
+        conn.commit()
+
+    @property
+    def cursor(self):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'cursor'").fetchone()
+        return None if row is None else row[0]
+
+    def set_cursor(self, cursor):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('cursor', ?)", (str(cursor),))
+        self._conn.commit()
+
+    def replace_folders(self, folder_data_list):
+        # Folder changes are not reported as events, the folder list is small and always replaced
+        with self._conn:
+            self._conn.execute("DELETE FROM folders")
+            self._conn.executemany("INSERT INTO folders (id, parent_id, title, updated_time) VALUES (?, ?, ?, ?)", [
+                (data["id"], data["parent_id"], data["title"], data.get("updated_time")) for data in folder_data_list
+            ])
+
+    def upsert_notes(self, note_data_list):
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO notes (id, parent_id, title, body, updated_time) VALUES (?, ?, ?, ?, ?)", [
+                (data["id"], data["parent_id"], data["title"], data.get("body"), data.get("updated_time")) for data in note_data_list
+            ])
+
+    def delete_notes(self, note_ids):
+        with self._conn:
+            self._conn.executemany("DELETE FROM notes WHERE id = ?", [(note_id,) for note_id in note_ids])
+
+    def iter_folders(self):
+        for id, parent_id, title, updated_time in self._conn.execute("SELECT id, parent_id, title, updated_time FROM folders"):
+            yield {"id": id, "parent_id": parent_id, "title": title, "updated_time": updated_time}
+
+    def iter_notes(self, parent_id=None, with_body=True):
+        sql = "SELECT id, parent_id, title, %s, updated_time FROM notes" % ("body" if with_body else "NULL")
+        args = ()
+        if parent_id is not None:
+            sql += " WHERE parent_id = ?"
+            args = (parent_id,)
+        for id, parent_id, title, body, updated_time in self._conn.execute(sql, args):
+            yield {"id": id, "parent_id": parent_id, "title": title, "body": body, "updated_time": updated_time}
+
+    def get_note_body(self, note_id):
+        row = self._conn.execute("SELECT body FROM notes WHERE id = ?", (note_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def close(self):
+        self._conn.close()
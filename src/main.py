@@ -1,8 +1,8 @@
 #-*- encoding: utf-8 -*-
+import sys, logging
 # from application import Application
-from oap.statements.cn_bnk_grc import ChinaBankGRCProvider
-from oap.statements.cn_wechat import ChinaWechatProvider
 from oap.export_mgr import ExportManager
+from oap.metrics import METRICS
 
 def main():
     # app = Application()
@@ -10,8 +10,20 @@ def main():
     # print(">>>>>>>>", ChinaBankGRCImporter().start(r"e:\download\20251104172013\20251104172013.pdf").transactions)
     ipt_mgr = ExportManager("e:/projects/shane_app/oap_config.yaml")
     ipt_mgr.load_config()
-    ipt_mgr.load_all_files()
-    ipt_mgr.export_all()
+    # Logs go to stderr, the ledger may be written to stdout
+    logging.basicConfig(level=ipt_mgr.config.get("log_level", "INFO"), stream=sys.stderr,
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    output_path = ipt_mgr.config.get("output")
+    ledger_dir = ipt_mgr.config.get("ledger_dir")
+    if ipt_mgr.config.get("stream_export"):
+        ipt_mgr.export_stream(output_path)
+    elif ledger_dir:
+        ipt_mgr.load_all_files()
+        ipt_mgr.export_ledger(ledger_dir)
+    else:
+        ipt_mgr.load_all_files()
+        ipt_mgr.export_all(output_path)
+    print(METRICS.summary(), file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,116 @@
+# -*- encoding: utf-8 -*-
+"""On-disk cache of parsed statements, keyed by file content and provider"""
+import os, sys, json, pickle, zlib, hashlib, inspect, logging, importlib
+
+# Bump when the layout of cache entries changes
+CACHE_FORMAT = 1
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+ENTRY_SUFFIX = ".stmt"
+# Helpers every provider parses with, they are not in the provider's MRO
+SHARED_MODULES = ("oap.parsing", "oap.rules", "oap.transactions", "oap.utils")
+
+logger = logging.getLogger(__name__)
+
+def file_digest(file_path, chunk_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.hexdigest()
+
+_version_by_cls = {}
+def provider_version(provider_cls):
+    """Hash of the source files the provider class is built from, so editing
+    a provider, its base classes or the shared parsing helpers invalidates
+    what it parsed before."""
+    version = _version_by_cls.get(provider_cls)
+    if version is not None:
+        return version
+    sha = hashlib.sha256(str(getattr(provider_cls, "VERSION", "")).encode())
+    source_files = set()
+    for klass in provider_cls.__mro__:
+        if klass is object:
+            continue
+        try:
+            source_files.add(inspect.getsourcefile(sys.modules[klass.__module__]))
+        except (TypeError, KeyError):
+            continue
+    for module_name in SHARED_MODULES:
+        source_files.add(inspect.getsourcefile(importlib.import_module(module_name)))
+    for source_file in sorted(f for f in source_files if f):
+        with open(source_file, "rb") as f:
+            sha.update(f.read())
+    version = sha.hexdigest()
+    _version_by_cls[provider_cls] = version
+    return version
+
+class StatementCache(object):
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, provider_cls, params, file_path):
+        key_obj = [
+            CACHE_FORMAT,
+            f"{provider_cls.__module__}.{provider_cls.__qualname__}",
+            provider_version(provider_cls),
+            params,
+            file_digest(file_path),
+        ]
+        key_str = json.dumps(key_obj, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(key_str.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + ENTRY_SUFFIX)
+
+    def get(self, key):
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, "rb") as f:
+                data = f.read()
+            statement = pickle.loads(zlib.decompress(data))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Drop broken cache entry %s: %s", entry_path, e)
+            self._remove(entry_path)
+            return None
+        # Mark as recently used for eviction
+        os.utime(entry_path)
+        return statement
+
+    def put(self, key, statement):
+        data = zlib.compress(pickle.dumps(statement, protocol=pickle.HIGHEST_PROTOCOL))
+        entry_path = self._entry_path(key)
+        tmp_path = entry_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, entry_path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(ENTRY_SUFFIX):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        # Least recently used first
+        entries.sort()
+        for _, size, entry_path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(entry_path)
+            total -= size
+
+    def _remove(self, entry_path):
+        try:
+            os.remove(entry_path)
+        except FileNotFoundError:
+            pass
@@ -1,38 +1,149 @@
-import yaml, importlib
+import os, sys, yaml, logging, importlib
+from concurrent.futures import ProcessPoolExecutor
 from .transactions import Transaction
+from .cache import StatementCache, DEFAULT_MAX_BYTES
+from .incremental import IncrementalState
+from .reconcile import Reconciler
+from .ledger_writer import ShardedLedgerWriter
+from .metrics import METRICS, profiled
+
+logger = logging.getLogger(__name__)
+
+def _run_provider(provider, file_path, profile_options):
+    with profiled(f"{provider.key}-{os.path.basename(file_path)}", **profile_options):
+        return provider.start(file_path)
+
+PROVIDER_ENTRY_POINT_GROUP = "oap.providers"
+
+# Provider instances of a worker process, reused across the files it is handed
+_worker_providers = {}
+
+def _import_file(provider_cls, key, cfg, file_path, profile_options):
+    # Runs inside a worker process, so the provider is built here rather than shipped over.
+    METRICS.reset()
+    provider = _worker_providers.get(key)
+    if provider is None:
+        provider = provider_cls(key, **cfg)
+        _worker_providers[key] = provider
+    statement = _run_provider(provider, file_path, profile_options)
+    # Stage timings of the worker are merged into the parent's METRICS
+    return statement, METRICS.snapshot()
+
+class LedgerWriter(object):
+    """Collects output lines and writes them out in large chunks instead of one print per line"""
+    def __init__(self, output_path=None, chunk_lines=4096, append=False):
+        self._owns_output = output_path is not None
+        self._out = open(output_path, "a" if append else "w", encoding="utf-8") if self._owns_output else sys.stdout
+        self._chunk_lines = chunk_lines
+        self._lines = []
+
+    def write_line(self, line):
+        self._lines.append(line)
+        if len(self._lines) >= self._chunk_lines:
+            self.flush()
+
+    def flush(self):
+        if self._lines:
+            self._lines.append("")
+            self._out.write("\n".join(self._lines))
+            self._lines.clear()
+        self._out.flush()
+
+    def close(self):
+        self.flush()
+        if self._owns_output:
+            self._out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 class ExportManager(object):
-    def __init__(self, config_path=None):
+    def __init__(self, config_path=None, workers=None):
         # Load config
         self.config_path = config_path
         self.config = None
         self.statements = []
         self.statement_list_by_key = {}
+        # key -> (cls path, config) as configured, resolved into provider_cls on first use
+        self._provider_specs = {}
         self.provider_cls = {}
-    
+        self._providers = {}
+        # None means "use import_workers from config", 1 keeps the serial import
+        self.workers = workers
+        self.cache = None
+        self.incremental = None
+        self.reconciler = None
+        self.profile_options = {}
+
     def load_config(self):
         self.config = yaml.safe_load(open(self.config_path, encoding="utf-8")) if self.config_path else {}
+        if self.workers is None:
+            self.workers = self.config.get("import_workers", 1)
+        cache_cfg = self.config.get("cache")
+        if cache_cfg:
+            self.cache = StatementCache(cache_cfg["dir"], cache_cfg.get("max_bytes", DEFAULT_MAX_BYTES))
+        incremental_cfg = self.config.get("incremental")
+        if incremental_cfg:
+            self.incremental = IncrementalState(incremental_cfg["state_path"])
+        metrics_cfg = self.config.get("metrics") or {}
+        self.profile_options = {
+            "profile": metrics_cfg.get("profile", False),
+            "trace_memory": metrics_cfg.get("tracemalloc", False),
+            "profile_dir": metrics_cfg.get("profile_dir"),
+        }
+        reconcile_cfg = self.config.get("reconcile")
+        if reconcile_cfg:
+            self.reconciler = Reconciler(reconcile_cfg["left"], reconcile_cfg["right"],
+                                         reconcile_cfg.get("window_days", 1), reconcile_cfg.get("skip_payment_methods", ()))
         self.regist_all_providers()
 
     def _regist_provider(self, key, config):
+        # Nothing is imported here, so pdfplumber/openpyxl only load for providers a file uses.
+        # Without cls, the provider is looked up by key in the oap.providers entry points.
         cls_path = config.pop("cls", None)
+        self._provider_specs[key] = (cls_path, config)
+        self.statement_list_by_key.setdefault(key, [])
+
+    def _get_provider_cls(self, key):
+        """Returns (provider class, config), importing the provider module on first use"""
+        resolved = self.provider_cls.get(key)
+        if resolved is not None:
+            return resolved
+        cls_path, config = self._provider_specs[key]
         if cls_path is None:
-            return
-        module_name, class_name = cls_path.rsplit('.', 1)
-        module = importlib.import_module(module_name)
-        provider_cls = getattr(module, class_name)
-        config["class_name"] = class_name
+            provider_cls = self._load_provider_entry_point(key)
+        else:
+            module_name, class_name = cls_path.rsplit('.', 1)
+            module = importlib.import_module(module_name)
+            provider_cls = getattr(module, class_name)
+        config["class_name"] = provider_cls.__name__
         self.provider_cls[key] = (provider_cls, config)
-        self.statement_list_by_key.setdefault(key, [])
+        return self.provider_cls[key]
+
+    @staticmethod
+    def _load_provider_entry_point(key):
+        from importlib.metadata import entry_points
+        for entry_point in entry_points(group=PROVIDER_ENTRY_POINT_GROUP):
+            if entry_point.name == key:
+                return entry_point.load()
+        raise LookupError(f"No cls configured and no {PROVIDER_ENTRY_POINT_GROUP} entry point for provider {key}")
 
     def _new_importer_provider(self, key):
-        print(">>>>>>>>>>>>", key)
-        provider_cls, cfg = self.provider_cls.get(key, None)
-        if provider_cls is None:
-            return
-        
+        logger.debug("New provider for %s", key)
+        provider_cls, cfg = self._get_provider_cls(key)
         new_importer = provider_cls(key, **cfg)
         return new_importer
+
+    def _get_provider(self, key):
+        """The provider instance of key, built once and reused for every file"""
+        provider = self._providers.get(key)
+        if provider is None:
+            provider = self._new_importer_provider(key)
+            self._providers[key] = provider
+        return provider
     def regist_all_providers(self):
         importers = self.config.get("importers", {})
         for key, config in importers.items():
@@ -40,18 +151,55 @@ class ExportManager(object):
 
     def load_all_files(self):
         file_to_import = self.config.get("files", {})
-        for file_entry in file_to_import:
-            print(f"Load file:{file_entry}")
-            provider_key = file_entry["key"]
-            file_path = file_entry["file_path"]
-            provider = self._new_importer_provider(provider_key)
-            
-            statement = provider.start(file_path)
-            if statement is None:
-                print(f"Failed to import file {file_path} with provider {provider_key}")
-                continue
-            print(f"Imported statement: {statement}")
-            self._add_statement(statement)
+        statements = [None] * len(file_to_import)
+        cache_keys = [None] * len(file_to_import)
+        pending = []
+        for idx, file_entry in enumerate(file_to_import):
+            logger.info("Load file: %s", file_entry["file_path"], extra={"provider": file_entry["key"]})
+            if self.cache is not None:
+                provider_cls, cfg = self._get_provider_cls(file_entry["key"])
+                cache_keys[idx] = self.cache.make_key(provider_cls, cfg.get("params"), file_entry["file_path"])
+                statements[idx] = self.cache.get(cache_keys[idx])
+                if statements[idx] is not None:
+                    logger.info("Cache hit for file %s", file_entry["file_path"], extra={"provider": file_entry["key"]})
+                    METRICS.count("cache hits")
+                    continue
+            pending.append(idx)
+
+        if self.workers and self.workers > 1 and len(pending) > 1:
+            self._load_files_parallel(file_to_import, pending, statements)
+        else:
+            for idx in pending:
+                file_entry = file_to_import[idx]
+                provider = self._get_provider(file_entry["key"])
+                statements[idx] = _run_provider(provider, file_entry["file_path"], self.profile_options)
+
+        if self.cache is not None:
+            for idx in pending:
+                if statements[idx]:
+                    self.cache.put(cache_keys[idx], statements[idx])
+
+        for file_entry, statement in zip(file_to_import, statements):
+            self._on_statement_loaded(file_entry["key"], file_entry["file_path"], statement)
+
+    def _load_files_parallel(self, file_to_import, pending, statements):
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = []
+            for idx in pending:
+                file_entry = file_to_import[idx]
+                provider_cls, cfg = self._get_provider_cls(file_entry["key"])
+                futures.append(executor.submit(_import_file, provider_cls, file_entry["key"], cfg, file_entry["file_path"], self.profile_options))
+            # Merge in config order, whatever order the workers finish in
+            for idx, future in zip(pending, futures):
+                statements[idx], worker_metrics = future.result()
+                METRICS.merge(worker_metrics)
+
+    def _on_statement_loaded(self, provider_key, file_path, statement):
+        if not statement:
+            logger.warning("Failed to import file %s with provider %s", file_path, provider_key, extra={"provider": provider_key, "file": file_path})
+            return
+        logger.info("Imported statement: %s", statement, extra={"provider": provider_key, "file": file_path, "txns": len(statement.transactions)})
+        self._add_statement(statement)
 
     def _add_statement(self, statement):
         self.statements.append(statement)
@@ -60,10 +208,98 @@ class ExportManager(object):
     def add_file_with_provider(self, provider, file_path):
         self.file_to_import.append((provider, file_path))
 
-    def export_all(self):
-        for provider_key, statements in self.statement_list_by_key.items():
-            for statement in statements:
-                print(f";; Exporting statement for account: {statement.account_name}")
-                for txn in statement.transactions:
-                    beancount_txn = txn.to_beancount_txn()
-                    print(beancount_txn.export_beancount())
\ No newline at end of file
+    def _open_writer(self, output_path):
+        # Incremental runs only emit new postings, so they extend the ledger file
+        return LedgerWriter(output_path, append=self.incremental is not None)
+
+    def _new_transactions(self, statement, transactions):
+        """The transactions of statement to export, all of them unless the export is incremental"""
+        if self.incremental is None:
+            return transactions
+        return self.incremental.filter_new(statement, transactions)
+
+    def _write_statement(self, writer, statement, transactions, reconciled=None):
+        # Incremental runs only write the header of statements with something new
+        if self.incremental is None:
+            writer.write_line(f";; Exporting statement for account: {statement.account_name}")
+        header_written = self.incremental is None
+        merged_by_left, matched_right = reconciled or ({}, set())
+        export_count = 0
+        for txn in transactions:
+            if id(txn) in matched_right:
+                # Already exported as part of the merged transaction on the other side
+                continue
+            if not header_written:
+                writer.write_line(f";; Exporting statement for account: {statement.account_name}")
+                header_written = True
+            beancount_txn = merged_by_left.get(id(txn)) or txn.to_beancount_txn()
+            writer.write_line(beancount_txn.export_beancount())
+            export_count += 1
+        METRICS.count("exported txns", export_count)
+
+    def _finish_export(self):
+        if self.incremental is not None:
+            self.incremental.save()
+
+    def export_all(self, output_path=None):
+        exports = [(statement, self._new_transactions(statement, statement.transactions))
+                   for statements in self.statement_list_by_key.values() for statement in statements]
+        candidates = None
+        if self.incremental is not None:
+            exports = [(statement, list(transactions)) for statement, transactions in exports]
+            # A pair is only merged when both sides are new, a side exported by an
+            # earlier run is in the ledger already and the other side goes out on its own
+            candidates = {id(txn) for _, transactions in exports for txn in transactions}
+        reconciled = self._reconcile(candidates)
+        with METRICS.timer("export"), self._open_writer(output_path) as writer:
+            for statement, transactions in exports:
+                self._write_statement(writer, statement, transactions, reconciled)
+        self._finish_export()
+
+    def export_ledger(self, ledger_dir):
+        """Write statements into ledger_dir sharded by month and account, touching only changed shards"""
+        reconciled = self._reconcile()
+        with METRICS.timer("export"):
+            writer = ShardedLedgerWriter(ledger_dir)
+            for statement in self.statements:
+                writer.add_statement(statement, reconciled)
+            written, unchanged = writer.write()
+        METRICS.count("shards written", written)
+        METRICS.count("shards unchanged", unchanged)
+        logger.info("Ledger shards written: %d, unchanged: %d", written, unchanged)
+
+    def _reconcile(self, candidates=None):
+        if self.reconciler is None:
+            return None
+        with METRICS.timer("reconcile"):
+            return self.reconciler.reconcile(self.statements, candidates)
+
+    def export_stream(self, output_path=None):
+        """Parse and export file by file without keeping statements around.
+
+        Statements come out in the order of the files: section, and nothing is
+        added to statements/statement_list_by_key. Reconciliation needs every
+        statement at once, so it is not applied here."""
+        file_to_import = self.config.get("files", {})
+        with METRICS.timer("export"), self._open_writer(output_path) as writer:
+            for file_entry in file_to_import:
+                logger.info("Stream file: %s", file_entry["file_path"], extra={"provider": file_entry["key"]})
+                txn_iter = self._stream_file(file_entry["key"], file_entry["file_path"])
+                statement = next(txn_iter, None)
+                if statement is None:
+                    logger.warning("Failed to import file %s with provider %s", file_entry["file_path"], file_entry["key"])
+                    continue
+                # Parsing happens lazily inside the write, so "export" includes the stages the provider times
+                self._write_statement(writer, statement, self._new_transactions(statement, txn_iter))
+        self._finish_export()
+
+    def _stream_file(self, provider_key, file_path):
+        if self.cache is not None:
+            provider_cls, cfg = self._get_provider_cls(provider_key)
+            statement = self.cache.get(self.cache.make_key(provider_cls, cfg.get("params"), file_path))
+            if statement is not None:
+                yield statement
+                yield from statement.transactions
+                return
+        provider = self._get_provider(provider_key)
+        yield from provider.stream(file_path)
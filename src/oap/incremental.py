@@ -0,0 +1,118 @@
+# -*- encoding: utf-8 -*-
+"""Remembers what has been exported already, so overlapping statements only emit new postings"""
+import os, json, hashlib, logging
+
+STATE_FORMAT = 2
+# Days of format 1 states before their watermark were all exported
+_BEFORE_ANY_DAY = "0001-01-01"
+
+logger = logging.getLogger(__name__)
+
+def _inside(spans, day):
+    return any(start < day < end for start, end in spans)
+
+def _merge_span(spans, new_span):
+    """spans plus new_span, overlapping spans joined. Spans only sharing an end
+    day stay apart, that day may be exported partly by each of them."""
+    merged = []
+    for start, end in sorted(spans + [new_span]):
+        if merged and start < merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+class IncrementalState(object):
+    """Per provider/account spans of exported statements plus a fingerprint index of exported transactions.
+
+    A span is the [first day, last day] a statement covered. Transactions on days
+    strictly inside an exported span are skipped outright; others (the end days of
+    a span, where a statement may stop mid-day, and days no statement covered yet,
+    e.g. an older statement downloaded later) are looked up in the fingerprint
+    index, which only needs to keep entries outside the spans' inner days.
+    """
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self._accounts = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.state_path):
+            return
+        with open(self.state_path, encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("format") == 1:
+            for account_state in state["accounts"].values():
+                watermark = account_state.pop("watermark")
+                account_state["spans"] = [[_BEFORE_ANY_DAY, watermark]] if watermark else []
+        elif state.get("format") != STATE_FORMAT:
+            logger.warning("Ignore incremental state %s with unknown format", self.state_path)
+            return
+        self._accounts = state["accounts"]
+
+    def save(self):
+        for account_state in self._accounts.values():
+            spans = account_state["spans"]
+            account_state["seen"] = {fp: day for fp, day in account_state["seen"].items() if not _inside(spans, day)}
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"format": STATE_FORMAT, "accounts": self._accounts}, f, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+    @staticmethod
+    def account_key(statement):
+        return f"{statement.provider}|{statement.account_id or statement.account_name}"
+
+    @staticmethod
+    def fingerprint(txn, occurrence):
+        # GRCTransaction.seq restarts in every statement, so the same row gets a
+        # different seq in overlapping downloads. Rows are told apart by their
+        # balance plus the occurrence of an identical row within the statement.
+        key = "|".join((
+            txn.txn_dt.isoformat(),
+            str(txn.amount),
+            str(getattr(txn, "balance", "")),
+            getattr(txn, "counterparty", ""),
+            str(occurrence),
+        ))
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def statement_span(statement, first_day, last_day):
+        """[first day, last day] statement covers, from its query span when it has one"""
+        if statement.query_start_at is not None and statement.query_end_at is not None:
+            return [statement.query_start_at.date().isoformat(), statement.query_end_at.date().isoformat()]
+        return [first_day, last_day]
+
+    def filter_new(self, statement, transactions):
+        """Yield only the transactions of statement that were not exported yet.
+
+        Transactions are recorded as exported as they are yielded, and the span of
+        statement once all of them were; call save() once the export has been written."""
+        account_state = self._accounts.setdefault(self.account_key(statement), {"spans": [], "seen": {}})
+        spans = account_state["spans"]
+        seen = account_state["seen"]
+        occurrences = {}
+        first_day = last_day = None
+        skipped = 0
+        for txn in transactions:
+            day = txn.txn_dt.date().isoformat()
+            first_day = day if first_day is None else min(first_day, day)
+            last_day = day if last_day is None else max(last_day, day)
+            if _inside(spans, day):
+                skipped += 1
+                continue
+            row_key = (txn.txn_dt, txn.amount, getattr(txn, "balance", None), getattr(txn, "counterparty", ""))
+            occurrence = occurrences.get(row_key, 0)
+            occurrences[row_key] = occurrence + 1
+            fp = self.fingerprint(txn, occurrence)
+            if fp in seen:
+                skipped += 1
+                continue
+            seen[fp] = day
+            yield txn
+        new_span = self.statement_span(statement, first_day, last_day)
+        if None not in new_span:
+            account_state["spans"] = _merge_span(spans, new_span)
+        if skipped:
+            logger.info("Skipped %d transactions already exported for %s", skipped, self.account_key(statement))
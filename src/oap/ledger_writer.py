@@ -0,0 +1,103 @@
+# -*- encoding: utf-8 -*-
+"""Writes exported transactions into the ledger repository, one file per month and account"""
+import os, re, json, hashlib
+from .incremental import IncrementalState
+
+SHARD_MANIFEST = ".shards.json"
+INDEX_FILE = "imported.bean"
+_UNSAFE_CHARS_RE = re.compile(r"[^\w.-]+")
+
+def atomic_write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+class ShardedLedgerWriter(object):
+    """Renders whole statements into ledger_dir/YYYY/MM/<account>.bean shards.
+
+    A shard is only rewritten when its content hash changed, so re-exporting
+    the same statements leaves the ledger untouched."""
+    def __init__(self, ledger_dir):
+        self.ledger_dir = ledger_dir
+        self._shards = {}
+        self._date_strs = {}
+        self._posting_prefixes = {}
+        self._manifest_path = os.path.join(ledger_dir, SHARD_MANIFEST)
+        self._manifest = {}
+        self._manifest_dirty = False
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, encoding="utf-8") as f:
+                self._manifest = json.load(f)
+
+    def _date_str(self, dt):
+        day = dt.date() if hasattr(dt, "date") else dt
+        date_str = self._date_strs.get(day)
+        if date_str is None:
+            date_str = day.strftime("%Y-%m-%d")
+            self._date_strs[day] = date_str
+        return date_str
+
+    def _posting_prefix(self, account):
+        prefix = self._posting_prefixes.get(account)
+        if prefix is None:
+            prefix = f"    {account}    "
+            self._posting_prefixes[account] = prefix
+        return prefix
+
+    def render(self, txn):
+        """Same text as Transaction.export_beancount, with dates and accounts formatted once"""
+        lines = [f"{self._date_str(txn.date)} * \"{txn.description}\""]
+        for key, value in txn.meta.items():
+            lines.append(f"    {key}: \"{value}\"")
+        for sub_txn in txn.sub_transactions:
+            lines.append(f"{self._posting_prefix(sub_txn.account)}{sub_txn.amount:.2f} {sub_txn.commodity}  ; {sub_txn.description}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def account_slug(statement):
+        account = statement.account_id or statement.account_name or "unknown"
+        return _UNSAFE_CHARS_RE.sub("_", f"{statement.provider}-{account}")
+
+    def add_statement(self, statement, reconciled=None):
+        merged_by_left, matched_right = reconciled or ({}, set())
+        slug = self.account_slug(statement)
+        occurrences = {}
+        for txn in statement.transactions:
+            if id(txn) in matched_right:
+                continue
+            # Overlapping downloads of the same account land in the same shard once
+            row_key = (txn.txn_dt, txn.amount, getattr(txn, "balance", None), getattr(txn, "counterparty", ""))
+            occurrence = occurrences.get(row_key, 0)
+            occurrences[row_key] = occurrence + 1
+            rel_path = f"{txn.txn_dt.year:04d}/{txn.txn_dt.month:02d}/{slug}.bean"
+            shard = self._shards.setdefault(rel_path, {})
+            shard.setdefault(IncrementalState.fingerprint(txn, occurrence), (txn.txn_dt, merged_by_left.get(id(txn)) or txn.to_beancount_txn()))
+
+    def write(self):
+        """Write changed shards and the include index, returns (written, unchanged) counts"""
+        written = unchanged = 0
+        for rel_path, shard in sorted(self._shards.items()):
+            entries = sorted(shard.values(), key=lambda entry: entry[0])
+            data = ("\n".join(self.render(beancount_txn) for _, beancount_txn in entries) + "\n").encode("utf-8")
+            if self._write_if_changed(rel_path, data):
+                written += 1
+            else:
+                unchanged += 1
+        index = "".join(f"include \"{rel_path}\"\n" for rel_path in sorted(self._manifest) if rel_path != INDEX_FILE)
+        self._write_if_changed(INDEX_FILE, index.encode("utf-8"))
+        if self._manifest_dirty:
+            atomic_write(self._manifest_path, json.dumps(self._manifest, indent=1, sort_keys=True).encode("utf-8"))
+            self._manifest_dirty = False
+        return written, unchanged
+
+    def _write_if_changed(self, rel_path, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.ledger_dir, rel_path)
+        if self._manifest.get(rel_path) == digest and os.path.exists(path):
+            return False
+        atomic_write(path, data)
+        self._manifest[rel_path] = digest
+        self._manifest_dirty = True
+        return True
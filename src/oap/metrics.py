@@ -0,0 +1,107 @@
+# -*- encoding: utf-8 -*-
+"""Stage timers, counters and opt-in profiling for the import pipeline"""
+import os, io, time, logging, contextlib
+
+logger = logging.getLogger(__name__)
+
+class Metrics(object):
+    def __init__(self):
+        # stage -> [total seconds, calls]
+        self.timers = {}
+        self.counters = {}
+
+    def add_time(self, stage, seconds, calls=1):
+        timer = self.timers.setdefault(stage, [0.0, 0])
+        timer[0] += seconds
+        timer[1] += calls
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def timed_iter(self, stage, iterable):
+        """Yield from iterable, timing only the time spent producing items, not consuming them"""
+        iterator = iter(iterable)
+        perf_counter = time.perf_counter
+        elapsed = 0.0
+        calls = 0
+        try:
+            while True:
+                start = perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    elapsed += perf_counter() - start
+                    return
+                elapsed += perf_counter() - start
+                calls += 1
+                yield item
+        finally:
+            self.add_time(stage, elapsed, calls)
+
+    def snapshot(self):
+        return {"timers": {k: list(v) for k, v in self.timers.items()}, "counters": dict(self.counters)}
+
+    def merge(self, snapshot):
+        for stage, (seconds, calls) in snapshot["timers"].items():
+            self.add_time(stage, seconds, calls)
+        for name, n in snapshot["counters"].items():
+            self.count(name, n)
+
+    def reset(self):
+        self.timers.clear()
+        self.counters.clear()
+
+    def summary(self):
+        width = max([len(name) for name in list(self.timers) + list(self.counters)] + [len("counter")]) + 2
+        lines = [f"{'stage':<{width}}{'calls':>10}{'total s':>12}{'avg ms':>12}"]
+        for stage, (seconds, calls) in sorted(self.timers.items(), key=lambda item: -item[1][0]):
+            avg_ms = seconds * 1000 / calls if calls else 0.0
+            lines.append(f"{stage:<{width}}{calls:>10}{seconds:>12.3f}{avg_ms:>12.3f}")
+        if self.counters:
+            lines.append(f"{'counter':<{width}}{'value':>10}")
+            for name, n in sorted(self.counters.items()):
+                lines.append(f"{name:<{width}}{n:>10}")
+        return "\n".join(lines)
+
+METRICS = Metrics()
+
+@contextlib.contextmanager
+def profiled(name, profile=False, trace_memory=False, profile_dir=None, top=20):
+    """Optionally run the block under cProfile and/or tracemalloc and report what they saw"""
+    if not profile and not trace_memory:
+        yield
+        return
+    profiler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+    if trace_memory:
+        import tracemalloc
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            import pstats
+            if profile_dir:
+                os.makedirs(profile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(profile_dir, f"{name}.prof"))
+            stats_out = io.StringIO()
+            pstats.Stats(profiler, stream=stats_out).sort_stats("cumulative").print_stats(top)
+            logger.info("Profile of %s:\n%s", name, stats_out.getvalue(), extra={"profile": name})
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            METRICS.count("peak KiB " + name, peak // 1024)
+            logger.info("Peak traced memory of %s: %d KiB", name, peak // 1024, extra={"profile": name, "peak_kib": peak // 1024})
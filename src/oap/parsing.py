@@ -0,0 +1,47 @@
+# -*- encoding: utf-8 -*-
+"""Locale independent parsers for the amounts and dates found in statements"""
+import datetime, functools
+from decimal import Decimal
+
+DATE_FMT = "%Y%m%d"
+DATETIME_FMT = "%Y-%m-%d %H:%M:%S"
+
+# Thousands separators, currency symbols (half and full width) and blanks
+_AMOUNT_DELETE = str.maketrans("", "", ",¥￥ \t\n")
+
+def parse_amount(amount_str):
+    """Parse a CNY amount such as '¥1,234.50' or '-1,234.50' into a Decimal"""
+    if isinstance(amount_str, (int, Decimal)):
+        return Decimal(amount_str)
+    if isinstance(amount_str, float):
+        return Decimal(str(amount_str))
+    return Decimal(amount_str.translate(_AMOUNT_DELETE))
+
+def _parse_compact_date(dt_str):
+    if len(dt_str) != 8 or not dt_str.isdigit():
+        raise ValueError(dt_str)
+    return datetime.datetime(int(dt_str[0:4]), int(dt_str[4:6]), int(dt_str[6:8]))
+
+def _parse_iso_datetime(dt_str):
+    if len(dt_str) != 19:
+        raise ValueError(dt_str)
+    return datetime.datetime.fromisoformat(dt_str)
+
+_FAST_PARSERS = {
+    DATE_FMT: _parse_compact_date,
+    DATETIME_FMT: _parse_iso_datetime,
+}
+
+@functools.lru_cache(maxsize=65536)
+def parse_datetime(dt_str, fmt=DATETIME_FMT):
+    """Parse dt_str with fmt; statements repeat the same dates a lot, so results are memoized.
+
+    Known formats skip strptime, anything they reject (e.g. unpadded months)
+    still goes through strptime so the result is the same."""
+    fast_parser = _FAST_PARSERS.get(fmt)
+    if fast_parser is not None:
+        try:
+            return fast_parser(dt_str)
+        except ValueError:
+            pass
+    return datetime.datetime.strptime(dt_str, fmt)
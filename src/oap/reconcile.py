@@ -0,0 +1,70 @@
+# -*- encoding: utf-8 -*-
+"""Matches the same payment seen by two providers, e.g. a WeChat payment funded by a bank card"""
+from oap.transactions import Transaction
+
+class Reconciler(object):
+    def __init__(self, left_keys, right_keys, window_days=1, skip_payment_methods=()):
+        self.left_keys = set(left_keys)
+        self.right_keys = set(right_keys)
+        self.window_days = window_days
+        self.skip_payment_methods = set(skip_payment_methods)
+        # Same day first, then one day off either way, and so on
+        self._day_offsets = [0]
+        for offset in range(1, window_days + 1):
+            self._day_offsets.extend((-offset, offset))
+
+    @staticmethod
+    def _bucket_key(txn, day_offset=0):
+        # Signed amount, so a refund never pairs with a payment of the same size
+        return (int(txn.amount * 100), txn.txn_dt.toordinal() + day_offset)
+
+    def _is_card_funded(self, txn):
+        # Incomes and balance payments have no card leg on the right side
+        payment_method = getattr(txn, "payment_method", None)
+        return payment_method is not None and payment_method not in self.skip_payment_methods and txn.amount < 0
+
+    def match(self, statements, candidates=None):
+        """Pair card-funded left expenses with right transactions of the same signed amount within the date window.
+
+        Only transactions whose id() is in candidates take part, when it is given.
+        Right transactions are hashed into (amount, day) buckets, so every left
+        transaction only probes 2 * window_days + 1 buckets. Returns [(left, right)]."""
+        buckets = {}
+        left_txns = []
+        for statement in statements:
+            transactions = statement.transactions
+            if candidates is not None:
+                transactions = [txn for txn in transactions if id(txn) in candidates]
+            if statement.provider in self.right_keys:
+                for txn in transactions:
+                    buckets.setdefault(self._bucket_key(txn), []).append(txn)
+            elif statement.provider in self.left_keys:
+                left_txns.extend(txn for txn in transactions if self._is_card_funded(txn))
+
+        pairs = []
+        left_txns.sort(key=lambda txn: txn.txn_dt)
+        for left in left_txns:
+            for day_offset in self._day_offsets:
+                candidates = buckets.get(self._bucket_key(left, day_offset))
+                if candidates:
+                    pairs.append((left, candidates.pop(0)))
+                    break
+        return pairs
+
+    @staticmethod
+    def merge(left, right):
+        """One Transaction carrying the payer leg from the right side and the payee leg from the left"""
+        new_txn = Transaction(left.txn_dt, left.postscript or right.postscript)
+        new_txn.add_sub_txn(right.payer_account or left.payer_account, getattr(right, "summary", ""), left.amount)
+        new_txn.add_sub_txn(left.payee_account or right.payee_account, left.counterparty, -left.amount)
+        new_txn.meta["reconciled_with"] = f"{right.txn_dt.strftime('%Y-%m-%d')} {right.counterparty}"
+        return new_txn
+
+    def reconcile(self, statements, candidates=None):
+        """Returns ({id(left): merged Transaction}, {id(right)}) for the export to substitute and skip"""
+        merged_by_left = {}
+        matched_right = set()
+        for left, right in self.match(statements, candidates):
+            merged_by_left[id(left)] = self.merge(left, right)
+            matched_right.add(id(right))
+        return merged_by_left, matched_right
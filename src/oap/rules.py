@@ -0,0 +1,209 @@
+# -*- encoding: utf-8 -*-
+"""Payer/payee account classification rules, compiled into a tree of combined regexes per field.
+
+payer_accounts/payee_accounts in the provider params are either the plain mapping
+used so far (payment method -> account, exact match) or a list of rules:
+
+    payee_accounts:
+      - account: Expenses:Food
+        counterparty: {keyword: [美团, 饿了么]}
+      - account: Expenses:Transport
+        counterparty: {prefix: [滴滴]}
+        postscript: {regex: ["^打车"]}
+        amount: [-500, 0]
+
+A rule matches when any of its patterns matches (or it has none) and the amount
+lies in its inclusive [min, max] range, where either bound may be null.
+Earlier rules win.
+"""
+import re
+from decimal import Decimal
+
+FIELDS = ("counterparty", "postscript", "summary", "payment_method")
+
+class AccountRule(object):
+    def __init__(self, rule_id, account, patterns, amount_range):
+        self.rule_id = rule_id
+        self.account = account
+        # [(field, kind, pattern)]
+        self.patterns = patterns
+        self.min_amount, self.max_amount = amount_range
+
+    def amount_matches(self, amount):
+        if self.min_amount is not None and amount < self.min_amount:
+            return False
+        if self.max_amount is not None and amount > self.max_amount:
+            return False
+        return True
+
+def _pattern_regex(kind, pattern):
+    if kind == "exact":
+        return r"\A" + re.escape(pattern) + r"\Z"
+    if kind == "prefix":
+        return r"\A" + re.escape(pattern)
+    if kind == "keyword":
+        return re.escape(pattern)
+    if kind == "regex":
+        return "(?:" + pattern + ")"
+    raise ValueError(f"Unknown match kind {kind}, expect exact, prefix, keyword or regex")
+
+def _to_decimal(value):
+    return None if value is None else Decimal(str(value))
+
+def _trie_regex(literals):
+    """Regex matching any of literals, with common prefixes factored out.
+
+    A plain alternation tries every literal at every position of the text, the
+    trie only follows the branches that the next character allows."""
+    trie = {}
+    for literal in literals:
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        node[""] = None
+
+    def emit(node):
+        branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char != ""]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            return "(?:" + body + ")?"
+        return body
+
+    return emit(trie)
+
+def _combined_regex(patterns):
+    """One regex matching when any of the (kind, pattern) patterns does"""
+    literals_by_kind = {"keyword": [], "prefix": [], "exact": []}
+    alternatives = []
+    for kind, pattern in patterns:
+        if kind in literals_by_kind:
+            literals_by_kind[kind].append(pattern)
+        else:
+            alternatives.append(_pattern_regex(kind, pattern))
+    if literals_by_kind["keyword"]:
+        alternatives.append(_trie_regex(literals_by_kind["keyword"]))
+    if literals_by_kind["prefix"]:
+        alternatives.append(r"\A(?:" + _trie_regex(literals_by_kind["prefix"]) + ")")
+    if literals_by_kind["exact"]:
+        alternatives.append(r"\A(?:" + _trie_regex(literals_by_kind["exact"]) + r")\Z")
+    return re.compile("|".join(alternatives), re.S)
+
+# Rules per leaf of the rule tree, below this testing them one by one is cheaper
+_LEAF_RULES = 8
+
+class _RuleNode(object):
+    """Rules lo..hi-1 in rule order, with one combined regex per field over all their patterns"""
+    __slots__ = ("lo", "hi", "matchers", "has_unconditional", "children")
+
+    def __init__(self, rules, lo, hi):
+        self.lo = lo
+        self.hi = hi
+        patterns_by_field = {}
+        for rule in rules[lo:hi]:
+            for field, kind, pattern in rule.patterns:
+                patterns_by_field.setdefault(field, []).append((kind, pattern))
+        self.matchers = [(field, _combined_regex(patterns)) for field, patterns in patterns_by_field.items()]
+        self.has_unconditional = any(not rule.patterns for rule in rules[lo:hi])
+        self.children = None
+        if hi - lo > _LEAF_RULES:
+            mid = (lo + hi) // 2
+            self.children = (_RuleNode(rules, lo, mid), _RuleNode(rules, mid, hi))
+
+    def matches(self, texts):
+        if self.has_unconditional:
+            return True
+        for field, matcher in self.matchers:
+            text = texts.get(field)
+            if text and matcher.search(text) is not None:
+                return True
+        return False
+
+class AccountRules(object):
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+        self._fields = sorted({field for rule in self.rules for field, _, _ in rule.patterns}, key=FIELDS.index)
+        # [(field, regex)] of every rule, tested one by one in the leaves of the tree
+        self._rule_patterns = [
+            [(field, re.compile(_pattern_regex(kind, pattern), re.S)) for field, kind, pattern in rule.patterns]
+            for rule in self.rules
+        ]
+        self._root = _RuleNode(self.rules, 0, len(self.rules)) if self.rules else None
+        self._memo = {}
+
+    @classmethod
+    def from_config(cls, config):
+        if not config:
+            return cls()
+        rules = []
+        if isinstance(config, dict):
+            # Legacy mapping: payment method -> account
+            for rule_id, (method, account) in enumerate(config.items()):
+                rules.append(AccountRule(rule_id, account, [("payment_method", "exact", method)], (None, None)))
+            return cls(rules)
+        for rule_id, rule_cfg in enumerate(config):
+            patterns = []
+            for field in FIELDS:
+                for kind, field_patterns in (rule_cfg.get(field) or {}).items():
+                    if isinstance(field_patterns, str):
+                        field_patterns = [field_patterns]
+                    patterns.extend((field, kind, pattern) for pattern in field_patterns)
+            min_amount, max_amount = rule_cfg.get("amount") or (None, None)
+            rules.append(AccountRule(rule_id, rule_cfg["account"], patterns, (_to_decimal(min_amount), _to_decimal(max_amount))))
+        return cls(rules)
+
+    def _rule_matches(self, rule_id, texts):
+        patterns = self._rule_patterns[rule_id]
+        if not patterns:
+            return True
+        for field, regex in patterns:
+            text = texts.get(field)
+            if text and regex.search(text) is not None:
+                return True
+        return False
+
+    def _first_match(self, node, texts, start, known_match=False):
+        """Id of the first rule from start on in node whose patterns match texts, None when none does.
+
+        A node whose combined regexes miss is skipped whole, so finding the rule
+        takes about one search per tree level instead of one per rule. known_match
+        says the node is known to hold a matching rule from start on."""
+        if node.hi <= start or not (known_match or node.matches(texts)):
+            return None
+        if node.children is None:
+            for rule_id in range(max(node.lo, start), node.hi):
+                if self._rule_matches(rule_id, texts):
+                    return rule_id
+            return None
+        left, right = node.children
+        rule_id = self._first_match(left, texts, start)
+        if rule_id is not None:
+            return rule_id
+        # The node matched from start on and its left half did not, so the right half does
+        return self._first_match(right, texts, start, known_match or start <= node.lo)
+
+    def classify(self, txn, **field_values):
+        """Account of the first rule matching txn, field_values override txn attributes"""
+        if self._root is None:
+            return None
+        texts = {}
+        for field in self._fields:
+            text = field_values[field] if field in field_values else getattr(txn, field, None)
+            if text:
+                texts[field] = text
+        memo_key = tuple(texts.get(field) for field in self._fields)
+        rule_id = self._memo.get(memo_key, -1)
+        if rule_id == -1:
+            rule_id = self._first_match(self._root, texts, 0)
+            self._memo[memo_key] = rule_id
+        # An amount range rejecting the rule lets the rules after it have their turn
+        while rule_id is not None:
+            rule = self.rules[rule_id]
+            if rule.amount_matches(txn.amount):
+                return rule.account
+            rule_id = self._first_match(self._root, texts, rule_id + 1)
+        return None
+
+    def __bool__(self):
+        return bool(self.rules)
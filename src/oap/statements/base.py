@@ -3,6 +3,7 @@
 
 from decimal import Decimal
 from oap.transactions import Transaction
+from oap.rules import AccountRules
 
 class BaseStatement(object):
     def __init__(self):
@@ -24,19 +25,40 @@ class BaseStatementProvider(object):
     def __init__(self, key, class_name, params):
         assert(self.NAME == class_name)
         self.key = key
-        self.params = params
+        self.params = params or {}
+        self.payer_rules = AccountRules.from_config(self.get_param("payer_accounts"))
+        self.payee_rules = AccountRules.from_config(self.get_param("payee_accounts"))
         
     def start(self, file):
         raise NotImplementedError("Subclasses must implement start method")
+
+    def stream(self, file):
+        """Yield the statement first, then its transactions one by one.
+
+        Providers that can parse lazily override this and leave the statement's
+        transactions list empty; this fallback parses the whole file up front."""
+        statement = self.start(file)
+        if not statement:
+            return
+        yield statement
+        yield from statement.transactions
     
     def get_param(self, name, default=None):
         return self.params.get(name, default)
+
+    def classify_accounts(self, transaction):
+        """Fill payer/payee accounts that are still unknown from the configured rules"""
+        if transaction.payer_account is None and self.payer_rules:
+            transaction.payer_account = self.payer_rules.classify(transaction)
+        if transaction.payee_account is None and self.payee_rules:
+            transaction.payee_account = self.payee_rules.classify(transaction)
     
 class BaseTransaction(object):
     def __init__(self):
         self.txn_dt = None
         self.amount = Decimal()
         self.postscript = ""
+        self.counterparty = ""
         self.payer_account = None
         self.payee_account = None
 
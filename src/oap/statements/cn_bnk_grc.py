@@ -1,19 +1,23 @@
 
-import re, datetime, locale, decimal
+import re, time, logging
 import pdfplumber
 
+from oap.parsing import parse_amount, parse_datetime, DATE_FMT
+from oap.metrics import METRICS
 from .base import BaseStatementProvider, BaseStatement, BaseTransaction
 
+logger = logging.getLogger(__name__)
+
 class GRCStatement(BaseStatement):
     def __init__(self):
         super().__init__()
 
     def set_apply_datetime(self, datetime_str):
-        self.apply_dt = datetime.datetime.strptime(datetime_str, "%Y-%m-%d %H:%M:%S")
+        self.apply_dt = parse_datetime(datetime_str)
     
     def set_query_dt_span(self, timespan_str):
-        self.query_start_at = datetime.datetime.strptime(timespan_str[0:8], "%Y%m%d")
-        self.query_end_at = datetime.datetime.strptime(timespan_str[9:16], "%Y%m%d")
+        self.query_start_at = parse_datetime(timespan_str[0:8], DATE_FMT)
+        self.query_end_at = parse_datetime(timespan_str[9:17], DATE_FMT)
 
 class GRCTransaction(BaseTransaction):
     HEADER = ["序号", "交易日期", "交易金额", "账户余额", "对方账号", "对方账户名", "对方开户行", "摘要", "附言"]
@@ -27,11 +31,12 @@ class GRCTransaction(BaseTransaction):
         assert(len(row) == len(self.HEADER))
         super().__init__()
         self.seq = int(row[0].strip())
-        self.txn_dt = datetime.datetime.strptime(row[1].strip(), "%Y%m%d")
-        self.amount = decimal.Decimal(locale.delocalize(row[2].strip()))
-        self.balance = decimal.Decimal(locale.delocalize(row[3].strip()))
+        self.txn_dt = parse_datetime(row[1].strip(), DATE_FMT)
+        self.amount = parse_amount(row[2])
+        self.balance = parse_amount(row[3])
         self.other_account_id = row[4].strip()
         self.other_account_name = row[5].strip()
+        self.counterparty = self.other_account_name
         self.other_bank = row[6].strip()
         self.summary = row[7].strip()
         self.postscript = row[8].strip()
@@ -43,24 +48,39 @@ class ChinaBankGRCProvider(BaseStatementProvider):
     TITLE = "广州农商银行"
     SEC_TITLE = "账户交易流水对账单"
     NAME = "ChinaBankGRCProvider"
+    # Extra room around the learnt table bbox so border lines survive the crop
+    FAST_CROP_MARGIN = 2
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._cur_statement = None
 
-    def start(self, file):
-        loc = locale.getlocale()
-        locale.setlocale(locale.LC_ALL, "zh_CN.UTF-8")
-        # TODO Check cur statement
+    def _new_statement(self):
         self._cur_statement = GRCStatement()
         self._cur_statement.provider = self.key
-        with pdfplumber.open(file) as pdf:
-            self.fill_statement_base(pdf)
+        return self._cur_statement
+
+    def start(self, file):
+        # TODO Check cur statement
+        self._new_statement()
+        with METRICS.timer("file open"):
+            pdf = pdfplumber.open(file)
+        with pdf:
+            with METRICS.timer("header parse"):
+                self.fill_statement_base(pdf)
             self.fill_transactions(pdf)
-        print(self._cur_statement)
-        # Resume locale
-        locale.setlocale(locale.LC_ALL, loc)
+        logger.info("Parsed %s", self._cur_statement, extra={"provider": self.key, "file": file})
         return self._cur_statement
-    
+
+    def stream(self, file):
+        statement = self._new_statement()
+        with METRICS.timer("file open"):
+            pdf = pdfplumber.open(file)
+        with pdf:
+            with METRICS.timer("header parse"):
+                self.fill_statement_base(pdf)
+            yield statement
+            yield from self.iter_transactions(pdf)
+
     def fill_statement_base(self, pdf):
         assert(self._cur_statement)
         index_page = pdf.pages[0]
@@ -89,21 +109,46 @@ class ChinaBankGRCProvider(BaseStatementProvider):
                 self._cur_statement.set_apply_datetime(match.group(4).strip())
         
     def fill_transactions(self, pdf):
+        for transaction in self.iter_transactions(pdf):
+            self._cur_statement.transactions.append(transaction)
+
+    def iter_transactions(self, pdf):
+        perf_counter = time.perf_counter
+        resolve_time = 0.0
+        row_count = 0
+        try:
+            for transaction in METRICS.timed_iter("row parse", self._parse_transactions(pdf)):
+                start = perf_counter()
+                self.classify_accounts(transaction)
+                resolve_time += perf_counter() - start
+                row_count += 1
+                yield transaction
+        finally:
+            METRICS.add_time("resolve", resolve_time, row_count)
+            METRICS.count(f"{self.key} rows", row_count)
+
+    def _parse_transactions(self, pdf):
+        if self.get_param("fast_extract", False):
+            page_tables = self.iter_page_tables_fast(pdf)
+        else:
+            page_tables = self.iter_page_tables(pdf)
         # peek header
         seq = 0
         header = None
-        for page in pdf.pages:
-            tbl = page.extract_table()
+        first_tbl = None
+        for tbl in page_tables:
+            if first_tbl is None:
+                first_tbl = tbl
             for row in tbl:
                 if row[0] == '':
                     continue
                 if seq == 0:
-                    header = pdf.pages[0].extract_table()[0]
+                    header = list(first_tbl[0])
                     GRCTransaction.NORMALIZED_HEADER(header)
                 else:
                     transaction = GRCTransaction(row)
-                    self._cur_statement.transactions.append(transaction)
                     assert(seq == transaction.seq)
+                    yield transaction
                 seq += 1
 
         #     # 这里根据具体的 PDF 格式进行解析
@@ -121,4 +166,37 @@ class ChinaBankGRCProvider(BaseStatementProvider):
         #                 'amount': amount,
         #                 'balance': balance
         #             }
-        #             transactions.append(transaction)
\ No newline at end of file
+        #             transactions.append(transaction)
+
+    def iter_page_tables(self, pdf):
+        for page in pdf.pages:
+            table = page.extract_table()
+            # Drop the layout objects pdfplumber keeps cached per page
+            page.close()
+            yield table
+
+    def iter_page_tables_fast(self, pdf):
+        # Learn the column layout from the first page, then extract the rest
+        # with fixed explicit settings on a page cropped to the table columns.
+        pages = pdf.pages
+        first_page = pages[0]
+        table = first_page.find_table()
+        if table is None:
+            yield from self.iter_page_tables(pdf)
+            return
+        yield table.extract()
+        col_xs = sorted({cell[0] for cell in table.cells} | {cell[2] for cell in table.cells})
+        x0, _, x1, _ = table.bbox
+        first_page.close()
+        table_settings = {
+            "vertical_strategy": "explicit",
+            "explicit_vertical_lines": col_xs,
+            "horizontal_strategy": "lines",
+        }
+        for page in pages[1:]:
+            page_x0, page_top, page_x1, page_bottom = page.bbox
+            cropped = page.crop((max(x0 - self.FAST_CROP_MARGIN, page_x0), page_top, min(x1 + self.FAST_CROP_MARGIN, page_x1), page_bottom))
+            yield cropped.extract_table(table_settings)
+            # Drop the layout objects pdfplumber keeps cached per page
+            cropped.close()
+            page.close()
@@ -1,27 +1,31 @@
 # -*- encoding: utf-8 -*-
-import re, datetime, decimal, locale
-import openpyxl
+import re, csv, time, itertools, logging
 from enum import Enum
 from oap.utils import moneyfmt
+from oap.parsing import parse_amount, parse_datetime
+from oap.metrics import METRICS
 from .base import BaseStatementProvider, BaseStatement, BaseTransaction
 
+logger = logging.getLogger(__name__)
+
 class WechatStatement(BaseStatement):
     def __init__(self):
         super(WechatStatement, self).__init__()
     def set_apply_datetime(self, datetime_str):
-        self.apply_dt = datetime.datetime.strptime(datetime_str, "%Y-%m-%d %H:%M:%S")
+        self.apply_dt = parse_datetime(datetime_str)
     
     def set_query_dt_span(self, start_str, end_str):
-        self.query_start_at = datetime.datetime.strptime(start_str, "%Y-%m-%d %H:%M:%S")
-        self.query_end_at = datetime.datetime.strptime(end_str, "%Y-%m-%d %H:%M:%S")
+        self.query_start_at = parse_datetime(start_str)
+        self.query_end_at = parse_datetime(end_str)
 
 class WechatTransaction(BaseTransaction):
     def __init__(self, rows):
         super(WechatTransaction, self).__init__()
-        self.txn_dt = datetime.datetime.strptime(rows[0].strip(), "%Y-%m-%d %H:%M:%S")
+        self.txn_dt = parse_datetime(rows[0].strip())
         self.postscript = rows[10].strip()
+        self.counterparty = (rows[2] or "").strip()
         # Convert money strings to decimal
-        self.amount = decimal.Decimal(locale.delocalize(rows[5].strip().replace(locale.localeconv()['currency_symbol'], '')))
+        self.amount = parse_amount(rows[5])
         if rows[4].strip() == "支出":
             self.amount = self.amount.copy_negate()
         if self.amount < 0:
@@ -41,76 +45,142 @@ class ChinaWechatProvider(BaseStatementProvider):
     ACCOUNT_NAME_RE = re.compile(r"^微信昵称：\[(?P<wechat_id>.+)\]$")
     TIMESPAN_RE = re.compile(r"^起始时间：\[(?P<start_at>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\] 终止时间：\[(?P<end_at>\d{4}-\d{1,2}-\d{1,2} \d{2}:\d{2}:\d{2})\]$")
     APPLY_DT_RE = re.compile(r"^导出时间：\[(?P<apply_dt>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\]$")
+    # Title, nickname, time span, export type and export time come before the bill table
+    HEAD_ROWS = 5
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._cur_statement = None
-        self._resolve_rule = self.get_param("payer_accounts")
-        print(f">>>>>{self._resolve_rule}")
+        logger.debug("Payer account rules: %s", self.get_param("payer_accounts"))
 
-    def start(self, file):
-        # TODO Implement WeChat statement parsing
-        loc = locale.getlocale()
-        locale.setlocale(locale.LC_ALL, "zh_CN.UTF-8")
+    def _new_statement(self):
         self._cur_statement = WechatStatement()
         self._cur_statement.provider = self.key
-        xlsx_statement = openpyxl.open(file)
-        active_sheet = xlsx_statement["Sheet1"]
-        if not self.fill_statement_base(active_sheet):
-            return False
-        if not self.fill_transactions(active_sheet):
-            return False
-        locale.setlocale(locale.LC_ALL, loc)
+        return self._cur_statement
+
+    def start(self, file):
+        # TODO Implement WeChat statement parsing
+        self._new_statement()
+        rows = self.iter_rows(file)
+        try:
+            with METRICS.timer("header parse"):
+                found_base = self.fill_statement_base(rows)
+            if not found_base:
+                return False
+            if not self.fill_transactions(rows):
+                return False
+        finally:
+            rows.close()
         # Parsing logic goes here
         return self._cur_statement
-    
-    def fill_statement_base(self, active_sheet):
-        
-        if active_sheet["A1"].value != self.TITLE:
+
+    def stream(self, file):
+        rows = self.iter_rows(file)
+        try:
+            statement = self._new_statement()
+            with METRICS.timer("header parse"):
+                found_base = self.fill_statement_base(rows)
+            if not found_base:
+                return
+            yield statement
+            yield from self.iter_transactions(rows)
+        finally:
+            rows.close()
+
+    def iter_rows(self, file):
+        """Row values of a WeChat bill, either the xlsx or the csv export.
+
+        The file is opened here, before any header timer starts; rows are read as they are iterated."""
+        with METRICS.timer("file open"):
+            raw_rows, close = self._open_raw_rows(file)
+        return self._iter_rows(raw_rows, close)
+
+    @staticmethod
+    def _iter_rows(raw_rows, close):
+        try:
+            for row_cells in raw_rows:
+                # Keep blank rows indexable, like empty rows of a fully loaded sheet
+                yield row_cells if row_cells else (None,)
+        finally:
+            close()
+
+    def _open_raw_rows(self, file):
+        if str(file).lower().endswith(".csv"):
+            f = open(file, encoding=self.get_param("csv_encoding", "utf-8-sig"), newline="")
+            return csv.reader(f), f.close
+        # Only xlsx bills need openpyxl, keep it out of csv-only runs
+        import openpyxl
+        # Read-only mode streams rows out of the sheet xml instead of loading every cell and style
+        xlsx_statement = openpyxl.load_workbook(file, read_only=True)
+        sheet = xlsx_statement["Sheet1"]
+        # Read-only mode stops at the stored <dimension>, which exporters do not always
+        # keep right, read every row of the sheet xml instead
+        sheet.reset_dimensions()
+        return sheet.iter_rows(values_only=True), xlsx_statement.close
+
+    def fill_statement_base(self, rows):
+        head = [row_cells[0] if row_cells else None for row_cells in itertools.islice(rows, self.HEAD_ROWS)]
+        if len(head) < self.HEAD_ROWS or head[0] != self.TITLE:
             return False
         # We just ignore wechat_id for now
-        m = self.ACCOUNT_NAME_RE.match(active_sheet["A2"].value)
+        m = self.ACCOUNT_NAME_RE.match(head[1] or "")
         if m is None:
             return False
         
         self._cur_statement.account_name = m.group("wechat_id").strip()
-        m = self.TIMESPAN_RE.match(active_sheet["A3"].value)
+        m = self.TIMESPAN_RE.match(head[2] or "")
         if m is None:
             return False
         self._cur_statement.set_query_dt_span(m.group("start_at"), m.group("end_at"))
         
-        m = self.APPLY_DT_RE.match(active_sheet["A5"].value)
+        m = self.APPLY_DT_RE.match(head[4] or "")
         if m is None:
             return False
         self._cur_statement.set_apply_datetime(m.group("apply_dt"))
         return True
 
-    def fill_transactions(self, active_sheet):
+    def fill_transactions(self, rows):
+        for transaction in self.iter_transactions(rows):
+            self._cur_statement.transactions.append(transaction)
+        return True
+
+    def iter_transactions(self, rows):
+        perf_counter = time.perf_counter
+        resolve_time = 0.0
+        row_count = 0
+        try:
+            for transaction in METRICS.timed_iter("row parse", self._parse_transactions(rows)):
+                start = perf_counter()
+                self.resolve_payment_account(transaction)
+                resolve_time += perf_counter() - start
+                row_count += 1
+                yield transaction
+        finally:
+            METRICS.add_time("resolve", resolve_time, row_count)
+            METRICS.count(f"{self.key} rows", row_count)
+
+    def _parse_transactions(self, rows):
         # Locate the header row
         found_header = False
-        for row, row_cells in enumerate(active_sheet.iter_rows(values_only=True), start=1):
+        for row, row_cells in enumerate(rows, start=self.HEAD_ROWS + 1):
             if found_header:
                 if row_cells[0] is None or row_cells[0].strip() == "":
                     continue
-                transaction = WechatTransaction(row_cells)
-                self.resolve_payment_account(transaction)
-                self._cur_statement.transactions.append(transaction)
+                yield WechatTransaction(row_cells)
             elif row_cells[0] == "交易时间":
-                print("Found header at row", row)
+                logger.debug("Found header at row %d", row)
                 found_header = True
                 continue
-
-        return True
     
     def resolve_payment_account(self, transaction: WechatTransaction):
+        if transaction.payee_account is None and self.payee_rules:
+            transaction.payee_account = self.payee_rules.classify(transaction)
         # If it's not an expense, we just simply ignore it.
         if transaction.payment_method is None:
-            print(">>>>>>1")
             return True
         if transaction.payment_method == "零钱":
-            print(">>>>>>2")
-            transaction.payer_account = self._resolve_rule.get(f"微信支付({self._cur_statement.account_name})", None)
+            transaction.payer_account = self.payer_rules.classify(transaction, payment_method=f"微信支付({self._cur_statement.account_name})")
             return True
         else:
-            transaction.payer_account = self._resolve_rule.get(f"{transaction.payment_method}", None)
-            print(">>>>>>3", self._resolve_rule, transaction.payment_method, transaction.payer_account)
+            transaction.payer_account = self.payer_rules.classify(transaction)
+            logger.debug("Payment method %s resolved to %s", transaction.payment_method, transaction.payer_account)
             return True
\ No newline at end of file
@@ -0,0 +1,175 @@
+# -*- encoding: utf-8 -*-
+"""Columnar, NumPy backed store for transactions of many statements"""
+from decimal import Decimal
+import numpy as np
+from oap.transactions import Transaction
+
+# Amounts are kept as integer cents
+AMOUNT_SCALE = 100
+PERIOD_UNITS = {
+    "day": "datetime64[D]",
+    "month": "datetime64[M]",
+    "year": "datetime64[Y]",
+}
+
+class CategoryCodes(object):
+    """Interns strings into int32 codes, code 0 is reserved for None"""
+    def __init__(self):
+        self.values = [None]
+        self._code_by_value = {None: 0}
+
+    def code(self, value):
+        code = self._code_by_value.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self._code_by_value[value] = code
+        return code
+
+    def codes(self, values):
+        return np.fromiter((self.code(v) for v in values), dtype=np.int32)
+
+    def lookup(self, code):
+        return self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+class TransactionRow(object):
+    """Lightweight object view of one table row, for code that still wants objects"""
+    __slots__ = ("txn_dt", "amount", "payer_account", "payee_account", "counterparty", "postscript", "provider")
+
+    def __init__(self, txn_dt, amount, payer_account, payee_account, counterparty, postscript, provider):
+        self.txn_dt = txn_dt
+        self.amount = amount
+        self.payer_account = payer_account
+        self.payee_account = payee_account
+        self.counterparty = counterparty
+        self.postscript = postscript
+        self.provider = provider
+
+    def to_beancount_txn(self):
+        new_txn = Transaction(self.txn_dt, self.postscript)
+        new_txn.add_sub_txn(self.payer_account, "", self.amount)
+        new_txn.add_sub_txn(self.payee_account, "", -self.amount)
+        return new_txn
+
+    def __repr__(self):
+        return f"TransactionRow(txn_dt={self.txn_dt}, payer_account={self.payer_account}, payee_account={self.payee_account}, amount={self.amount}, counterparty={self.counterparty}, postscript={self.postscript})"
+
+class TransactionTable(object):
+    """One row per transaction, with
+
+    dt:           int64 seconds since epoch
+    amount:       int64 cents
+    payer/payee:  codes into self.accounts
+    counterparty: codes into self.counterparties
+    postscript:   codes into self.texts
+    provider:     codes into self.providers
+    """
+    INT_COLUMNS = ("dt", "amount")
+    CODE_COLUMNS = ("payer", "payee", "counterparty", "postscript", "provider")
+
+    def __init__(self):
+        self.accounts = CategoryCodes()
+        self.counterparties = CategoryCodes()
+        self.texts = CategoryCodes()
+        self.providers = CategoryCodes()
+        self._chunks = []
+        self._columns = None
+
+    @classmethod
+    def from_statements(cls, statements):
+        table = cls()
+        for statement in statements:
+            table.add_statement(statement)
+        return table
+
+    def add_statement(self, statement):
+        txns = statement.transactions
+        if not txns:
+            return
+        provider_code = self.providers.code(statement.provider)
+        chunk = {
+            "dt": np.array([txn.txn_dt for txn in txns], dtype="datetime64[s]").astype(np.int64),
+            "amount": np.fromiter((int((txn.amount * AMOUNT_SCALE).to_integral_value()) for txn in txns), dtype=np.int64, count=len(txns)),
+            "payer": self.accounts.codes(txn.payer_account for txn in txns),
+            "payee": self.accounts.codes(txn.payee_account for txn in txns),
+            "counterparty": self.counterparties.codes(getattr(txn, "counterparty", None) or None for txn in txns),
+            "postscript": self.texts.codes(txn.postscript for txn in txns),
+            "provider": np.full(len(txns), provider_code, dtype=np.int32),
+        }
+        self._chunks.append(chunk)
+        self._columns = None
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            if self._chunks:
+                self._columns = {name: np.concatenate([chunk[name] for chunk in self._chunks]) for name in self.INT_COLUMNS + self.CODE_COLUMNS}
+                # Keep a single chunk so later appends only concatenate once
+                self._chunks = [self._columns]
+            else:
+                self._columns = {name: np.empty(0, dtype=np.int64 if name in self.INT_COLUMNS else np.int32) for name in self.INT_COLUMNS + self.CODE_COLUMNS}
+        return self._columns
+
+    def __len__(self):
+        return len(self.columns["dt"])
+
+    def __getitem__(self, idx):
+        cols = self.columns
+        return TransactionRow(
+            cols["dt"][idx].astype("datetime64[s]").item(),
+            Decimal(int(cols["amount"][idx])).scaleb(-2),
+            self.accounts.lookup(cols["payer"][idx]),
+            self.accounts.lookup(cols["payee"][idx]),
+            self.counterparties.lookup(cols["counterparty"][idx]),
+            self.texts.lookup(cols["postscript"][idx]),
+            self.providers.lookup(cols["provider"][idx]),
+        )
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def postings(self):
+        """Both legs of every transaction: (dt, account code, amount in cents)"""
+        cols = self.columns
+        dt = np.concatenate([cols["dt"], cols["dt"]])
+        account = np.concatenate([cols["payer"], cols["payee"]])
+        amount = np.concatenate([cols["amount"], -cols["amount"]])
+        return dt, account, amount
+
+    def totals_by_account(self, period="month"):
+        """Sum of postings per account per period (day, month or year).
+
+        Returns (account codes, period starts as datetime64, totals in cents)."""
+        dt, account, amount = self.postings()
+        period_start = dt.astype("datetime64[s]").astype(PERIOD_UNITS[period])
+        keys = np.stack([account.astype(np.int64), period_start.astype(np.int64)], axis=1)
+        uniq, inverse = np.unique(keys, axis=0, return_inverse=True)
+        totals = np.zeros(len(uniq), dtype=np.int64)
+        np.add.at(totals, inverse.ravel(), amount)
+        return uniq[:, 0].astype(np.int32), uniq[:, 1].astype(PERIOD_UNITS[period]), totals
+
+    def monthly_totals(self):
+        """[(account, 'YYYY-MM', Decimal total)] for every account and month with postings"""
+        accounts, months, totals = self.totals_by_account("month")
+        return [(self.accounts.lookup(a), str(m), Decimal(int(t)).scaleb(-2)) for a, m, t in zip(accounts, months, totals)]
+
+    def running_balances(self):
+        """Per-account running balance of postings in date order.
+
+        Returns (dt, account codes, amounts, balances), sorted by account then date."""
+        dt, account, amount = self.postings()
+        order = np.lexsort((dt, account))
+        dt, account, amount = dt[order], account[order], amount[order]
+        cumsum = np.cumsum(amount)
+        if len(cumsum) == 0:
+            return dt, account, amount, cumsum
+        # Subtract the total carried over from previous accounts
+        group_start = np.flatnonzero(np.r_[True, account[1:] != account[:-1]])
+        carried = np.r_[0, cumsum[group_start[1:] - 1]]
+        group_len = np.diff(np.r_[group_start, len(cumsum)])
+        balances = cumsum - np.repeat(carried, group_len)
+        return dt, account, amount, balances
@@ -26,6 +26,8 @@ class Transaction(object):
     def export_beancount(self):
         lines = []
         lines.append(f"{self.date.strftime('%Y-%m-%d')} * \"{self.description}\"")
+        for key, value in self.meta.items():
+            lines.append(f"    {key}: \"{value}\"")
         for sub_txn in self.sub_transactions:
             amt_str = f"{sub_txn.amount:.2f}"
             lines.append(f"    {sub_txn.account}    {amt_str} {sub_txn.commodity}  ; {sub_txn.description}")
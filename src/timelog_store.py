@@ -0,0 +1,121 @@
+"""Columnar, NumPy backed store of timelog entries across daily notes"""
+import numpy as np
+from oap.table import CategoryCodes
+
+PERIODS = ("day", "week", "month")
+
+class TimelogStore(object):
+    """One row per (timelog entry, tag), untagged entries get tag code 0, with
+
+    day:      datetime64[D] the entry starts on
+    start:    datetime64[m] start of the entry
+    minutes:  int64 duration
+    tag:      codes into self.tags
+
+    Rows are kept per note together with the note's updated_time, so updating
+    the store after an edit only rebuilds the rows of the edited notes.
+    """
+    COLUMNS = ("day", "start", "minutes", "tag")
+
+    def __init__(self) -> None:
+        self.tags = CategoryCodes()
+        # note id -> (updated_time, {column: array})
+        self._notes = dict()
+        self._columns = None
+
+    def is_current(self, note_id, updated_time):
+        known = self._notes.get(note_id)
+        return known is not None and updated_time is not None and known[0] == updated_time
+
+    def update(self, note_id, updated_time, daily_note):
+        """Replace the rows of a note, returns False when the note was already up to date"""
+        if self.is_current(note_id, updated_time):
+            return False
+        starts, minutes, tags = [], [], []
+        for entry in daily_note.timelog:
+            entry_minutes = int(entry.delta_time.total_seconds()) // 60
+            for tag in entry.tags or [None]:
+                starts.append(entry.start_dt)
+                minutes.append(entry_minutes)
+                tags.append(tag)
+        start = np.array(starts, dtype="datetime64[m]")
+        self._notes[note_id] = (updated_time, {
+            "day": start.astype("datetime64[D]"),
+            "start": start,
+            "minutes": np.array(minutes, dtype=np.int64),
+            "tag": self.tags.codes(tags),
+        })
+        self._columns = None
+        return True
+
+    def remove(self, note_id):
+        if self._notes.pop(note_id, None) is not None:
+            self._columns = None
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            chunks = [chunk for _, chunk in self._notes.values()]
+            if chunks:
+                self._columns = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in self.COLUMNS}
+            else:
+                self._columns = {
+                    "day": np.empty(0, dtype="datetime64[D]"),
+                    "start": np.empty(0, dtype="datetime64[m]"),
+                    "minutes": np.empty(0, dtype=np.int64),
+                    "tag": np.empty(0, dtype=np.int32),
+                }
+        return self._columns
+
+    def __len__(self):
+        return len(self.columns["minutes"])
+
+    @staticmethod
+    def period_start(day, period):
+        if period == "day":
+            return day
+        if period == "week":
+            # Weeks start on Monday, 1970-01-01 was a Thursday
+            day_number = day.astype(np.int64)
+            return (day_number - (day_number + 3) % 7).astype("datetime64[D]")
+        if period == "month":
+            return day.astype("datetime64[M]").astype("datetime64[D]")
+        raise ValueError(f"Unknown period {period}, expect one of {PERIODS}")
+
+    def totals(self, period="day"):
+        """Minutes per period and tag.
+
+        Returns (period starts as datetime64[D], matrix of minutes [period, tag code])."""
+        cols = self.columns
+        starts, inverse = np.unique(self.period_start(cols["day"], period), return_inverse=True)
+        matrix = np.zeros((len(starts), len(self.tags)), dtype=np.int64)
+        np.add.at(matrix, (inverse.ravel(), cols["tag"]), cols["minutes"])
+        return starts, matrix
+
+    def tag_totals(self, tag, period="day"):
+        """(period starts, minutes) of one tag, None for untagged entries"""
+        starts, matrix = self.totals(period)
+        if tag not in self.tags.values:
+            return starts, np.zeros(len(starts), dtype=np.int64)
+        return starts, matrix[:, self.tags.values.index(tag)]
+
+    def rolling_totals(self, window_days=7):
+        """Minutes per tag over the window_days ending on each day, gaps included.
+
+        Returns (days as datetime64[D], matrix of minutes [day, tag code])."""
+        days, matrix = self.totals("day")
+        if len(days) == 0:
+            return days, matrix
+        all_days = np.arange(days[0], days[-1] + np.timedelta64(1, "D"), dtype="datetime64[D]")
+        dense = np.zeros((len(all_days), matrix.shape[1]), dtype=np.int64)
+        dense[(days - days[0]).astype(np.int64)] = matrix
+        cumsum = np.cumsum(dense, axis=0)
+        rolling = cumsum.copy()
+        rolling[window_days:] -= cumsum[:-window_days]
+        return all_days, rolling
+
+    def summary(self, period="month"):
+        """[(period, tag, minutes)] for every period and tag with time logged"""
+        starts, matrix = self.totals(period)
+        period_idx, tag_codes = np.nonzero(matrix)
+        return [(str(starts[p]), self.tags.lookup(t), int(matrix[p, t])) for p, t in zip(period_idx, tag_codes)]
@@ -0,0 +1,38 @@
+# -*- encoding: utf-8 -*-
+import re, zipfile
+import openpyxl
+from oap.statements.cn_wechat import ChinaWechatProvider
+
+HEADER = ["交易时间", "交易类型", "交易对方", "商品", "收/支", "金额(元)", "支付方式", "当前状态", "交易单号", "商户单号", "备注"]
+
+def write_bill(path, rows):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Sheet1"
+    for row_cells in [
+        [ChinaWechatProvider.TITLE], ["微信昵称：[me]"],
+        ["起始时间：[2024-03-01 00:00:00] 终止时间：[2024-03-31 23:59:59]"],
+        ["导出类型：[全部]"], ["导出时间：[2024-04-01 00:00:00]"], [None], HEADER,
+    ]:
+        sheet.append(row_cells)
+    for idx in range(rows):
+        sheet.append([f"2024-03-{idx % 28 + 1:02d} 12:00:00", "商户消费", "美团", "/", "支出", "¥10.00",
+                      "零钱", "支付成功", f"T{idx}", f"M{idx}", "/"])
+    workbook.save(path)
+
+def set_dimension(path, ref):
+    with zipfile.ZipFile(path) as src:
+        members = {name: src.read(name) for name in src.namelist()}
+    sheet_xml = members["xl/worksheets/sheet1.xml"].decode("utf-8")
+    members["xl/worksheets/sheet1.xml"] = re.sub(r'<dimension ref="[^"]*"', f'<dimension ref="{ref}"', sheet_xml).encode("utf-8")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as dst:
+        for name, data in members.items():
+            dst.writestr(name, data)
+
+def test_rows_past_a_wrong_dimension_are_read(tmp_path):
+    path = str(tmp_path / "bill.xlsx")
+    write_bill(path, 50)
+    set_dimension(path, "A1:K10")
+    provider = ChinaWechatProvider("wechat", "ChinaWechatProvider", {"payer_accounts": {"微信支付(me)": "Assets:Wechat"}})
+    statement = provider.start(path)
+    assert len(statement.transactions) == 50
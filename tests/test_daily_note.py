@@ -0,0 +1,64 @@
+import random
+import pytest
+from daily_note import DailyNote, check_fast_path, parse_daily_note
+
+FRONT_MATTER = "```yaml\ndate: 2024-01-01\nmood: ok\n```\n\n"
+
+LAYOUT_CASES = {
+    "plain": "- Summary\n    - fine\n- Timelog\n    - 09:00-10:30 write code #work #oap\n    - 10:30-11:00 coffee  \n- Notes\n    - n\n",
+    "continuation": "- Timelog\n    - 09:00-10:00 coffee\n      with friends #life\n    - 10:00-11:00 b\n",
+    "dummy_and_nested": "- Timelog\n    -\n    - 11:00-12:00 meet #work\n        - sub item\n    - 12:00-13:00 lunch\n",
+    "tab_indent": "- Timelog\n\t- 09:00-10:00 a #x\n\t- 10:00-11:00 b\n- Notes\n",
+    "ordered_list": "- Timelog\n    1. 09:00-10:00 a #x\n    2. 10:00-11:00 b\n- Notes\n",
+    "hard_break": "- Timelog\n    - 09:00-10:00 a #x  \n      more   \n    - 10:00-11:00 b  \n",
+    "extra_continuation_indent": "- Timelog\n    - 09:00-10:00 a\n            deeper\n    - 10:00-11:00 b\n",
+    "deep_item_continues_paragraph": "- Timelog\n  - 09:00-10:00 a #x\n        - sub\n",
+    "two_timelog_sections": "- Timelog\n  - 09:00-10:00 a\n- Notes\n- Timelog\n  - 10:00-11:00 b\n",
+    "paragraph_after_list": "- Timelog\n  - 09:00-10:00 a\n\nTrailing paragraph\n- not a section\n",
+    "no_entries": "- Timelog\n- Notes\n    - n\n",
+}
+
+@pytest.mark.parametrize("name", sorted(LAYOUT_CASES))
+def test_fast_path_matches_tree(name):
+    assert check_fast_path(FRONT_MATTER + LAYOUT_CASES[name]) == []
+
+def generate_note(rnd):
+    lines = []
+    indent = rnd.choice(["    ", "  "])
+    for section in rnd.sample(["Summary", "Timelog", "Notes", "Todo"], k=rnd.randint(1, 4)) + ["Timelog"]:
+        lines.append("- " + section)
+        for hour in range(8, 8 + rnd.randint(0, 10)):
+            kind = rnd.random()
+            if kind < 0.05:
+                lines.append(indent + "-")
+            elif kind < 0.1:
+                lines.append(indent + f"- {hour:02d}:00-{hour:02d}:45 long thing #work")
+                lines.append(indent + "  continued #more")
+            elif kind < 0.15:
+                lines.append(indent + f"- {hour:02d}:00-{hour:02d}:30 parent #x")
+                lines.append(indent * 2 + "- child item")
+            else:
+                lines.append(indent + f"- {hour:02d}:15-{hour + 1:02d}:00 task #{rnd.choice(['work', 'life'])}")
+        if rnd.random() < 0.2:
+            lines.append("")
+    return FRONT_MATTER + "\n".join(lines) + "\n"
+
+def test_fast_path_matches_tree_on_generated_notes(monkeypatch):
+    rnd = random.Random(20)
+    notes = [generate_note(rnd) for _ in range(300)]
+    expected = [parse_daily_note(note, fast=False) for note in notes]
+
+    def no_fallback(self, content):
+        raise AssertionError("plain daily note fell back to the tree parse")
+    monkeypatch.setattr(DailyNote, "set_content", no_fallback)
+    for note, tree_note in zip(notes, expected):
+        fast_note = parse_daily_note(note, fast=True)
+        assert fast_note.front_matter_obj == tree_note.front_matter_obj
+        assert fast_note.timelog_contents == tree_note.timelog_contents
+
+def test_timelog_entries_are_structured():
+    note = parse_daily_note(FRONT_MATTER + "- Timelog\n    - 23:30-00:15 late #work #oap\n")
+    entry, = note.timelog
+    assert entry.tags == ["work", "oap"]
+    assert entry.delta_time.total_seconds() == 45 * 60
+    assert entry.end_dt.day == 2
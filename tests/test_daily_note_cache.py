@@ -0,0 +1,23 @@
+from datetime import date
+from daily_note import parse_daily_note
+from daily_note_cache import DailyNoteCache
+
+BODY = "```yaml\nmood: ok\n```\n\n- Timelog\n    - 09:00-10:00 write #work\n"
+
+def test_renamed_note_gets_the_day_of_its_new_title(tmp_path):
+    cache = DailyNoteCache(str(tmp_path / "parsed.sqlite"))
+    old_day, new_day = date(2024, 1, 1), date(2024, 1, 2)
+    cache.store([("n1", BODY, parse_daily_note(BODY, day=old_day))])
+    daily_note, = cache.lookup([("n1", BODY, new_day)])
+    assert daily_note.day == new_day
+    assert daily_note.timelog[0].start_dt.date() == new_day
+    cache.close()
+
+def test_front_matter_date_wins_over_the_title(tmp_path):
+    cache = DailyNoteCache(str(tmp_path / "parsed.sqlite"))
+    body = BODY.replace("mood: ok", "date: 2024-03-05")
+    cache.store([("n1", body, parse_daily_note(body, day=date(2024, 1, 1)))])
+    daily_note, = cache.lookup([("n1", body, date(2024, 1, 2))])
+    assert daily_note.day == date(2024, 3, 5)
+    assert cache.lookup([("n1", body + "\n    - 10:00-11:00 more\n", None)]) == [None]
+    cache.close()
@@ -0,0 +1,48 @@
+# -*- encoding: utf-8 -*-
+import json
+from datetime import datetime
+from decimal import Decimal
+from oap.incremental import IncrementalState
+
+class Txn(object):
+    def __init__(self, month, day, amount, balance):
+        self.txn_dt = datetime(2024, month, day, 10)
+        self.amount = Decimal(amount)
+        self.balance = Decimal(balance)
+        self.counterparty = "shop"
+
+class Statement(object):
+    def __init__(self, start, end):
+        self.provider = "bank"
+        self.account_id = "1234"
+        self.account_name = ""
+        self.query_start_at = datetime(2024, *start)
+        self.query_end_at = datetime(2024, *end)
+
+def export(state, statement, transactions):
+    return list(state.filter_new(statement, transactions))
+
+def test_overlapping_statement_only_exports_new_rows(tmp_path):
+    state = IncrementalState(str(tmp_path / "state.json"))
+    march = [Txn(3, 5, "-10", "90"), Txn(3, 31, "-5", "85")]
+    assert export(state, Statement((3, 1), (3, 31)), march) == march
+    state.save()
+    state = IncrementalState(str(tmp_path / "state.json"))
+    april = [Txn(4, 2, "-1", "84")]
+    assert export(state, Statement((3, 15), (4, 15)), march + april) == april
+
+def test_older_statement_is_not_skipped(tmp_path):
+    state = IncrementalState(str(tmp_path / "state.json"))
+    march = [Txn(3, 5, "-10", "90")]
+    export(state, Statement((3, 1), (3, 31)), march)
+    state.save()
+    january = [Txn(1, 10, "-3", "100"), Txn(1, 20, "-2", "98")]
+    assert export(state, Statement((1, 1), (1, 31)), january) == january
+    assert export(state, Statement((1, 1), (3, 31)), january + march) == []
+
+def test_format_1_watermark_is_kept(tmp_path):
+    state_path = tmp_path / "state.json"
+    state_path.write_text(json.dumps({"format": 1, "accounts": {"bank|1234": {"watermark": "2024-03-31", "seen": {}}}}))
+    state = IncrementalState(str(state_path))
+    exported = export(state, Statement((3, 1), (4, 15)), [Txn(3, 5, "-10", "90"), Txn(4, 2, "-1", "84")])
+    assert [txn.txn_dt.month for txn in exported] == [4]
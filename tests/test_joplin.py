@@ -0,0 +1,12 @@
+from joplin import FolderHierarchy, Note
+
+def test_renamed_note_is_found_by_its_new_title():
+    folders = FolderHierarchy()
+    folders.add_folder_data({"id": "f1", "parent_id": "", "title": "Reports"})
+    note = Note()
+    note.fill_data({"id": "n1", "parent_id": "f1", "title": "2024-01"})
+    folders.add_note(note)
+    folders.refill_note(note, {"id": "n1", "parent_id": "f1", "title": "2024-01 spending", "body": "b"})
+    assert folders.get_notes_with_title("2024-01") == []
+    assert folders.get_notes_with_title("2024-01 spending") == [note]
+    assert note.body == "b"
@@ -0,0 +1,92 @@
+# -*- encoding: utf-8 -*-
+import pytest
+from datetime import datetime
+from decimal import Decimal
+from oap.export_mgr import ExportManager
+from oap.incremental import IncrementalState
+from oap.reconcile import Reconciler
+from oap.transactions import Transaction
+
+class Txn(object):
+    def __init__(self, day, amount, payment_method=None):
+        self.txn_dt = datetime(2024, 3, day, 12)
+        self.amount = Decimal(amount)
+        self.payment_method = payment_method
+
+class Statement(object):
+    def __init__(self, provider, transactions):
+        self.provider = provider
+        self.transactions = transactions
+
+def test_only_card_funded_expenses_are_matched():
+    card_expense = Txn(1, "-25.00", "招商银行(1234)")
+    balance_expense = Txn(1, "-25.00", "零钱")
+    income = Txn(2, "88.00")
+    bank_debit = Txn(1, "-25.00")
+    bank_credit = Txn(2, "88.00")
+    reconciler = Reconciler(["wechat"], ["bank"], skip_payment_methods=["零钱"])
+    pairs = reconciler.match([
+        Statement("wechat", [card_expense, balance_expense, income]),
+        Statement("bank", [bank_debit, bank_credit]),
+    ])
+    assert pairs == [(card_expense, bank_debit)]
+
+def test_signs_must_match():
+    reconciler = Reconciler(["wechat"], ["bank"])
+    pairs = reconciler.match([
+        Statement("wechat", [Txn(1, "-25.00", "招商银行(1234)")]),
+        Statement("bank", [Txn(1, "25.00")]),
+    ])
+    assert pairs == []
+
+class LedgerTxn(Txn):
+    def __init__(self, day, amount, payer_account, payee_account, payment_method=None):
+        super().__init__(day, amount, payment_method)
+        self.counterparty = "shop"
+        self.postscript = ""
+        self.payer_account = payer_account
+        self.payee_account = payee_account
+
+    def to_beancount_txn(self):
+        new_txn = Transaction(self.txn_dt, self.postscript)
+        new_txn.add_sub_txn(self.payer_account, "", self.amount)
+        new_txn.add_sub_txn(self.payee_account, "", -self.amount)
+        return new_txn
+
+def ledger_statement(provider, transactions):
+    statement = Statement(provider, transactions)
+    statement.account_id = provider
+    statement.account_name = provider
+    statement.query_start_at = datetime(2024, 3, 1)
+    statement.query_end_at = datetime(2024, 3, 31)
+    return statement
+
+def export_run(tmp_path, providers):
+    export_mgr = ExportManager(workers=1)
+    export_mgr.config = {}
+    export_mgr.incremental = IncrementalState(str(tmp_path / "state.json"))
+    export_mgr.reconciler = Reconciler(["wechat"], ["bank"])
+    statements = {
+        # The WeChat payment funded by the card, seen from both sides
+        "wechat": ledger_statement("wechat", [LedgerTxn(5, "-25.00", "Liabilities:Card", "Expenses:Food", "招商银行(1234)")]),
+        "bank": ledger_statement("bank", [LedgerTxn(5, "-25.00", "Assets:Bank", "Expenses:Unknown")]),
+    }
+    for provider in providers:
+        export_mgr.statement_list_by_key[provider] = []
+        export_mgr._add_statement(statements[provider])
+    export_mgr.export_all(str(tmp_path / "ledger.bean"))
+    return (tmp_path / "ledger.bean").read_text(encoding="utf-8")
+
+def test_pair_new_in_one_run_is_merged(tmp_path):
+    ledger = export_run(tmp_path, ["wechat", "bank"])
+    assert "Expenses:Unknown" not in ledger
+    assert ledger.count("Assets:Bank") == 1
+    assert 'reconciled_with: "2024-03-05' in ledger
+
+@pytest.mark.parametrize("first, second", [("wechat", "bank"), ("bank", "wechat")])
+def test_pair_split_across_runs_exports_each_side_once(tmp_path, first, second):
+    export_run(tmp_path, [first])
+    ledger = export_run(tmp_path, [first, second])
+    assert ledger.count("Liabilities:Card") == 1
+    assert ledger.count("Assets:Bank") == 1
+    assert "reconciled_with" not in ledger
@@ -0,0 +1,55 @@
+# -*- encoding: utf-8 -*-
+from decimal import Decimal
+from oap.rules import AccountRules
+
+class Txn(object):
+    def __init__(self, counterparty, amount, payment_method=None, postscript=""):
+        self.counterparty = counterparty
+        self.amount = Decimal(amount)
+        self.payment_method = payment_method
+        self.postscript = postscript
+
+def test_amount_rejected_rule_does_not_shadow_later_rule():
+    rules = AccountRules.from_config([
+        {"account": "Expenses:Transport", "counterparty": {"prefix": ["滴滴"]}, "amount": [-500, 0]},
+        {"account": "Expenses:Travel", "counterparty": {"prefix": ["滴滴"]}},
+    ])
+    assert rules.classify(Txn("滴滴出行", "-30")) == "Expenses:Transport"
+    assert rules.classify(Txn("滴滴出行", "-800")) == "Expenses:Travel"
+
+def test_overlapping_keywords_fall_through_in_rule_order():
+    rules = AccountRules.from_config([
+        {"account": "Expenses:Food:Small", "counterparty": {"keyword": ["美团"]}, "amount": [-50, 0]},
+        {"account": "Expenses:Food:Delivery", "counterparty": {"keyword": ["美团外卖"]}},
+    ])
+    assert rules.classify(Txn("美团外卖", "-20")) == "Expenses:Food:Small"
+    assert rules.classify(Txn("美团外卖", "-120")) == "Expenses:Food:Delivery"
+    assert rules.classify(Txn("美团打车", "-120")) is None
+
+def test_legacy_mapping_and_override():
+    rules = AccountRules.from_config({"微信支付(me)": "Assets:Wechat", "招商银行(1234)": "Liabilities:CM"})
+    assert rules.classify(Txn("x", "-1", payment_method="招商银行(1234)")) == "Liabilities:CM"
+    assert rules.classify(Txn("x", "-1", payment_method="零钱"), payment_method="微信支付(me)") == "Assets:Wechat"
+    assert rules.classify(Txn("x", "-1", payment_method="其他")) is None
+
+def test_unconditional_rule_is_fallback():
+    rules = AccountRules.from_config([
+        {"account": "Expenses:Food", "postscript": {"regex": ["^午饭"]}},
+        {"account": "Expenses:Other"},
+    ])
+    assert rules.classify(Txn("x", "-1", postscript="午饭 拉面")) == "Expenses:Food"
+    assert rules.classify(Txn("x", "-1", postscript="晚饭")) == "Expenses:Other"
+
+def test_first_matching_rule_wins_among_many():
+    config = []
+    for idx in range(40):
+        kind = ("keyword", "prefix", "exact", "regex")[idx % 4]
+        config.append({"account": f"Expenses:R{idx}", "postscript": {kind: [f"shop{idx:02d}"]}, "amount": [-100, 0] if idx % 5 == 0 else None})
+    config.append({"account": "Expenses:Shop", "postscript": {"keyword": ["shop"]}})
+    rules = AccountRules.from_config(config)
+    assert rules.classify(Txn("x", "-1", postscript="shop37 and shop39")) == "Expenses:R37"
+    assert rules.classify(Txn("x", "-1", postscript="shop14 and shop39")) == "Expenses:R39"
+    assert rules.classify(Txn("x", "-1", postscript="shop10")) == "Expenses:R10"
+    assert rules.classify(Txn("x", "-500", postscript="shop10")) == "Expenses:Shop"
+    assert rules.classify(Txn("x", "-500", postscript="shop20 shop23")) == "Expenses:R23"
+    assert rules.classify(Txn("x", "-1", postscript="other")) is None